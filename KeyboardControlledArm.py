@@ -1,9 +1,11 @@
 import math
 import curses
-from adafruit_servokit import ServoKit
-
-# Initialize the ServoKit instance for 16 channels (controls up to 16 servos)
-kit = ServoKit(channels=16)
+import os
+import time
+from collections import deque
+import hardware
+from control_loop import ControlLoop
+from motion_file import MotionRecorder, RECORDINGS_DIR
 
 # Lengths of each section of the robotic arm (in centimeters, update these values according to your arm)
 L1 = 12.7  # Length from shoulder to elbow
@@ -27,26 +29,66 @@ WRIST_MAX = 90
 GRIPPER_MIN = 90
 GRIPPER_MAX = 148
 
-# Angle step size for smoother movements
+# Angle step per control tick while a key is held, 25 degrees per second at 50 Hz
 ANGLE_STEP = 0.5
+RATE_HZ = 50
+
+# Terminals only send key presses, no releases, and a held key repeats at the terminal's own rate
+# (every 30-50 ms once it starts). A press moves the joint one step. A press that comes less than
+# REPEAT_TIMEOUT after the one before is a repeat, the key then counts as held (one step every tick)
+# until no repeat came for REPEAT_TIMEOUT. Taps further apart than that move one step each.
+REPEAT_TIMEOUT = 0.1
+held = {}  # {key: (presses, time of the last press)}
+
+# Text on each screen row, only rows whose text changed are written again (no clear, no flicker)
+screen = {}
+
+def show(stdscr, row, text):
+    if screen.get(row) != text:
+        stdscr.move(row, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(row, 0, text)
+        screen[row] = text
 
 # Function to display the current angles
 def display_angles(stdscr):
-    stdscr.clear()
-    stdscr.addstr(0, 0, f"Base Angle: {base_angle:.2f}°")
-    stdscr.addstr(1, 0, f"Shoulder Angle: {shoulder_angle:.2f}°")
-    stdscr.addstr(2, 0, f"Elbow Angle: {elbow_angle:.2f}°")
-    stdscr.addstr(3, 0, f"Wrist Angle: {wrist_angle:.2f}°")
-    stdscr.addstr(4, 0, f"Gripper Angle: {gripper_angle:.2f}°")
+    show(stdscr, 0, f"Base Angle: {base_angle:.2f}°")
+    show(stdscr, 1, f"Shoulder Angle: {shoulder_angle:.2f}°")
+    show(stdscr, 2, f"Elbow Angle: {elbow_angle:.2f}°")
+    show(stdscr, 3, f"Wrist Angle: {wrist_angle:.2f}°")
+    show(stdscr, 4, f"Gripper Angle: {gripper_angle:.2f}°")
     stdscr.refresh()
 
+# Function to read every key waiting, returns the keys pressed since the last tick
+def read_keys(stdscr, now):
+    pressed = []
+    while True:
+        key = stdscr.getch()
+        if key == -1:
+            break
+        if key not in pressed:
+            pressed.append(key)
+        presses, last = held.get(key, (0, now))
+        # Only the terminal repeats a key this fast, a press after a longer gap is a new tap
+        held[key] = (presses + 1 if now - last < REPEAT_TIMEOUT else 1, now)
+    return pressed
+
+# Function to tell if a key moves its joint this tick: just pressed, or held down and repeating
+def active(key, pressed, now):
+    if key in pressed:
+        return True
+    presses, last = held.get(key, (0, 0.0))
+    return presses > 1 and now - last < REPEAT_TIMEOUT
+
 # Function to update the servos
 def update_servos():
+    kit = hardware.get_servos()           # Servo output for 16 channels, only changed channels are sent
     kit.servo[0].angle = base_angle       # Base servo (controls left-right rotation)
     kit.servo[1].angle = shoulder_angle   # Shoulder servo (controls up-down movement from the base)
     kit.servo[2].angle = elbow_angle      # Elbow servo (controls bending of the arm)
     kit.servo[3].angle = wrist_angle      # Wrist servo (controls wrist orientation)
     kit.servo[4].angle = gripper_angle    # Gripper servo (controls opening and closing)
+    kit.flush()                           # Send the channels that changed in one I2C write
 
 # Function to adjust limits based on current angles to prevent collisions or hitting the ground
 def adjust_limits():
@@ -63,95 +105,204 @@ def adjust_limits():
     else:
         ELBOW_MIN = 60  # Restore normal elbow limit
 
-# Main loop to control the servos with keyboard using curses
+# Main loop to control the servos with keyboard using curses. Runs at a fixed rate and never waits
+# for a key, returns the loop statistics.
 def main(stdscr):
-    global base_angle, shoulder_angle, elbow_angle, wrist_angle, gripper_angle
-
-    # Hide the cursor
-    curses.curs_set(0)
+    # Hide the cursor (not every terminal can) and read keys without waiting for them
+    try:
+        curses.curs_set(0)
+    except curses.error:
+        pass
+    stdscr.nodelay(True)
 
     # Instructions
-    stdscr.addstr(6, 0, "Use 'w' and 's' to control the shoulder, 'a' and 'd' for the wrist, arrow keys for the base and elbow, 'o' to open and 'c' to close gripper. Press 'q' to exit.")
+    stdscr.addstr(6, 0, "Use 'w' and 's' to control the shoulder, 'a' and 'd' for the wrist, arrow keys for the base and elbow, 'o' to open and 'c' to close gripper. Press 'r' to start or stop recording, 'q' to exit.")
     stdscr.refresh()
 
-    while True:
-        key = stdscr.getch()
+    clock = hardware.get_clock()
+    loop = ControlLoop(hardware.get_servos(), RATE_HZ, clock=clock, log_interval=None)  # Printing would break the screen
+    latency = deque(maxlen=500)  # Seconds from reading a key to the servo write
+    started = clock.now()
+    last_report = started
+    recorder = None  # Recording of the session while 'r' is on, see motion_file.py
+    recording_started = None
+
+    def tick(number):
+        global base_angle, shoulder_angle, elbow_angle, wrist_angle, gripper_angle
+        nonlocal last_report, recorder, recording_started
+        now = clock.now()
+        pressed = read_keys(stdscr, now)
+
+        # Exit the loop on 'q'
+        if ord('q') in pressed:
+            if recorder is not None:
+                recorder.close()
+            return False
+
+        # Start or stop recording on 'r'
+        if ord('r') in pressed:
+            if recorder is None:
+                os.makedirs(RECORDINGS_DIR, exist_ok=True)
+                path = os.path.join(RECORDINGS_DIR, time.strftime("teleop_%Y%m%d_%H%M%S.motion"))
+                recorder = MotionRecorder(path)
+                recording_started = now
+                show(stdscr, 13, f"Recording to {path}")
+            else:
+                recorder.close()
+                show(stdscr, 13, f"Saved {recorder.count} samples to {recorder.path}")
+                recorder = None
 
         # Adjust limits based on current angles
         adjust_limits()
 
         # Shoulder control
-        if key == ord('w'):
+        if active(ord('w'), pressed, now):
             if shoulder_angle < SHOULDER_MAX:
                 shoulder_angle += ANGLE_STEP
             else:
-                stdscr.addstr(8, 0, f"Shoulder limit hit at {shoulder_angle:.2f}°")
-        elif key == ord('s'):
+                show(stdscr, 8, f"Shoulder limit hit at {shoulder_angle:.2f}°")
+        elif active(ord('s'), pressed, now):
             shoulder_angle -= ANGLE_STEP
         else:
-            stdscr.addstr(8, 0, " " * 50)
+            show(stdscr, 8, "")
 
         # Wrist control
-        if key == ord('a'):
+        if active(ord('a'), pressed, now):
             if wrist_angle > WRIST_MIN:
                 wrist_angle -= ANGLE_STEP
             else:
-                stdscr.addstr(9, 0, f"Wrist limit hit at {wrist_angle:.2f}°")
-        elif key == ord('d'):
+                show(stdscr, 9, f"Wrist limit hit at {wrist_angle:.2f}°")
+        elif active(ord('d'), pressed, now):
             if wrist_angle < WRIST_MAX:
                 wrist_angle += ANGLE_STEP
             else:
-                stdscr.addstr(9, 0, f"Wrist limit hit at {wrist_angle:.2f}°")
+                show(stdscr, 9, f"Wrist limit hit at {wrist_angle:.2f}°")
         else:
-            stdscr.addstr(9, 0, " " * 50)
+            show(stdscr, 9, "")
 
         # Base control
-        if key == curses.KEY_LEFT:
+        if active(curses.KEY_LEFT, pressed, now):
             if base_angle > BASE_MIN:
                 base_angle -= ANGLE_STEP
             else:
-                stdscr.addstr(10, 0, f"Base limit hit at {base_angle:.2f}°")
-        elif key == curses.KEY_RIGHT:
+                show(stdscr, 10, f"Base limit hit at {base_angle:.2f}°")
+        elif active(curses.KEY_RIGHT, pressed, now):
             if base_angle < BASE_MAX:
                 base_angle += ANGLE_STEP
             else:
-                stdscr.addstr(10, 0, f"Base limit hit at {base_angle:.2f}°")
+                show(stdscr, 10, f"Base limit hit at {base_angle:.2f}°")
         else:
-            stdscr.addstr(10, 0, " " * 50)
+            show(stdscr, 10, "")
 
         # Elbow control
-        if key == curses.KEY_UP:
+        if active(curses.KEY_UP, pressed, now):
             if elbow_angle < ELBOW_MAX:
                 elbow_angle += ANGLE_STEP
             else:
-                stdscr.addstr(11, 0, f"Elbow limit hit at {elbow_angle:.2f}°")
-        elif key == curses.KEY_DOWN:
+                show(stdscr, 11, f"Elbow limit hit at {elbow_angle:.2f}°")
+        elif active(curses.KEY_DOWN, pressed, now):
             if elbow_angle > ELBOW_MIN:
                 elbow_angle -= ANGLE_STEP
             else:
-                stdscr.addstr(11, 0, f"Elbow limit hit at {elbow_angle:.2f}°")
+                show(stdscr, 11, f"Elbow limit hit at {elbow_angle:.2f}°")
         else:
-            stdscr.addstr(11, 0, " " * 50)
+            show(stdscr, 11, "")
 
-        # Gripper control
-        if key == ord('o'):
+        # Gripper control, once per press
+        if ord('o') in pressed:
             if gripper_angle > GRIPPER_MIN:
                 gripper_angle = GRIPPER_MIN  # Fully open the gripper
-            stdscr.addstr(12, 0, f"Gripper opened to {gripper_angle:.2f}°")
-        elif key == ord('c'):
+            show(stdscr, 12, f"Gripper opened to {gripper_angle:.2f}°")
+        elif ord('c') in pressed:
             if gripper_angle < GRIPPER_MAX:
                 gripper_angle = GRIPPER_MAX  # Fully close the gripper
-            stdscr.addstr(12, 0, f"Gripper closed to {gripper_angle:.2f}°")
-        else:
-            stdscr.addstr(12, 0, " " * 50)
+            show(stdscr, 12, f"Gripper closed to {gripper_angle:.2f}°")
 
         # Update the servos with the new angles
         update_servos()
+        if pressed:
+            latency.append(clock.now() - now)
+        if recorder is not None:
+            recorder.add(now - recording_started, [base_angle, shoulder_angle, elbow_angle, wrist_angle, gripper_angle])
+
+        # Loop rate and latency, once a second
+        if now - last_report >= 1.0:
+            last_report = now
+            show(stdscr, 14, status_line(loop, started, now, latency))
         display_angles(stdscr)
 
-        # Exit the loop on 'q'
-        if key == ord('q'):
-            break
+    loop.run(tick)
+    return status_line(loop, started, clock.now(), latency)
+
+def status_line(loop, started, now, latency):
+    rate = loop.stats.ticks / (now - started) if now > started else 0.0
+    ordered = sorted(latency)
+    p50 = ordered[len(ordered) // 2] * 1000 if ordered else 0.0
+    worst = ordered[-1] * 1000 if ordered else 0.0
+    return (f"Loop {rate:.1f} Hz ({loop.stats.misses} ticks missed), key to servo p50 {p50:.2f} ms max {worst:.2f} ms "
+            f"(plus up to {1000 / RATE_HZ:.0f} ms until the key is read)")
+
+# Stand-in for the curses screen that types keys at given clock times, for running main() without a
+# terminal. keys is a list of (time, key).
+class ScriptedScreen:
+    def __init__(self, clock, keys):
+        self.clock = clock
+        self.keys = sorted(keys)
+
+    def getch(self):
+        if self.keys and self.keys[0][0] <= self.clock.now():
+            return self.keys.pop(0)[1]
+        return -1
+
+    def nodelay(self, flag):
+        pass
+
+    def move(self, row, column):
+        pass
+
+    def clrtoeol(self):
+        pass
 
-# Run the curses application
-curses.wrapper(main)
+    def addstr(self, row, column, text):
+        pass
+
+    def refresh(self):
+        pass
+
+# Function to drive main() with scripted keys on the simulated servos: four taps of 'w' 300 ms apart
+# have to move the shoulder exactly one step each, and holding 's' (the terminal repeats after 500 ms,
+# then every 33 ms) has to move it at 25 degrees per second until REPEAT_TIMEOUT after the last repeat
+def check_keys():
+    from clock import VirtualClock
+
+    clock = VirtualClock()
+    hardware.use_simulator(clock=clock)
+    start = shoulder_angle
+    taps = [(0.1 + 0.3 * tap, ord('w')) for tap in range(4)]
+    repeats = [2.5 + 0.033 * n for n in range(31)]
+    keys = taps + [(2.0, ord('s'))] + [(t, ord('s')) for t in repeats] + [(4.5, ord('q'))]
+    main(ScriptedScreen(clock, keys))
+
+    shoulder = [(t, angle) for t, channel, angle in hardware.get_servos().writes if channel == 1]
+    def angle_at(time):
+        return [angle for t, angle in shoulder if t <= time][-1]
+
+    tapped = angle_at(1.9) - start
+    assert tapped == 4 * ANGLE_STEP, f"four taps moved the shoulder {tapped:.2f} degrees"
+    # The press and the first repeat are single steps, then one step per tick while repeating
+    held_for = repeats[-1] - repeats[1] + REPEAT_TIMEOUT
+    expected = 2 * ANGLE_STEP + held_for * RATE_HZ * ANGLE_STEP
+    moved = angle_at(1.9) - angle_at(4.0)
+    assert abs(moved - expected) <= 2 * ANGLE_STEP, f"holding moved the shoulder {moved:.2f} degrees, not {expected:.2f}"
+    assert angle_at(4.0) == shoulder_angle, "the shoulder kept moving after the key was released"
+    hardware.close()
+    print(f"Four taps moved the shoulder {tapped:.2f} degrees, holding for {repeats[-1] - 2.0:.2f} s moved it {moved:.2f}")
+
+# Run the curses application (--check runs check_keys() instead, no terminal needed)
+if __name__ == "__main__":
+    import sys
+
+    if "--check" in sys.argv:
+        check_keys()
+    else:
+        print(curses.wrapper(main))
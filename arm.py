@@ -1,17 +1,64 @@
-import calculate_angles_for
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import ik_table
+import reachability
 import move_motor
 import camera
-from time import sleep
-from audio_in import listen_to_microphone
-from audio_out import speak_text
+import hardware
+import tracing
+from audio_out import prerender
+from coordinator import Coordinator, ACTIVATING_MESSAGE, READY_MESSAGE
 
 def get_motor_angles(x, y, z):
-    return calculate_angles_for.calculate(x, y, z)
+    # Constant-time lookup in the precomputed table instead of the G_z search
+    with tracing.span("ik"):
+        return ik_table.lookup(x, y, z)
 
-def main():
-    x_target, y_target, z_target = camera.get_marker_coordinates()
-    x_target = x_target - 1.5
-    z_target = z_target + 0.17 * z_target
+# Corrections between where the camera sees the block and where the arm has to go
+def correct_target(x, y, z):
+    return x - 1.5, y, z + 0.17 * z
+
+# Map of the camera positions the arm can reach (see reachability.py), loaded by load_workspace()
+workspace = None
+
+def load_workspace():
+    global workspace
+    if workspace is None:
+        workspace = reachability.load_or_build(correct_target)
+    return workspace
+
+# Function to turn down a block the arm can not reach before any IK or motion, camera coordinates
+def in_reach(x, y, z):
+    with tracing.span("reach check"):
+        return load_workspace().contains(x, y, z)
+
+# Function to go down to the block, grab it and lift it back up
+def grab(base_angle, shoulder_angle, elbow_angle, wrist_angle):
+    move_motor.move_motors({0: base_angle, 2: elbow_angle, 3: wrist_angle})
+    # Shoulder last, it lowers the gripper onto the block
+    move_motor.move_motor(1, shoulder_angle)
+    # Closing the gripper, pick_up() waits until it has a grip (its settle time in motion_profile.json)
+    move_motor.move_motor(4, 148)
+    move_motor.pick_up()
+
+# Function to pick up the block and place it, reset=False leaves moving home before and after to the caller
+def pick_and_place(base_angle, shoulder_angle, elbow_angle, wrist_angle, reset=True):
+    if reset:
+        move_motor.reset_motors()
+    grab(base_angle, shoulder_angle, elbow_angle, wrist_angle)
+    move_motor.place_it()
+    if reset:
+        move_motor.reset_motors()
+
+# Function to find the block and return the joint angles to reach it, None if it is out of reach
+def find_target():
+    # Filtered over a few frames so one noisy detection can not send the arm to the wrong place
+    x, y, z = camera.get_stable_marker_coordinates()
+    if not in_reach(x, y, z):
+        print(f"Block at x {x:.2f}, y {y:.2f}, z {z:.2f} is out of reach.")
+        return None
+    x_target, y_target, z_target = correct_target(x, y, z)
     angles = get_motor_angles(x_target, y_target, z_target)
     print(f"x-Target: {x_target:.2f}°")
     print(f"y-Target: {y_target:.2f}°")
@@ -22,23 +69,191 @@ def main():
         print(f"Shoulder Angle: {shoulder_angle:.2f}°")
         print(f"Elbow Angle: {elbow_angle:.2f}°")
         print(f"Wrist Angle: {wrist_angle:.2f}°")
-        move_motor.reset_motors()
-        move_motor.move_motor(0, base_angle)
-        move_motor.move_motor(2, elbow_angle)
-        move_motor.move_motor(3, wrist_angle)
-        move_motor.move_motor(1, shoulder_angle)
-        move_motor.move_motor(4, 148)
-        sleep(1)
-        move_motor.pick_up()
-        move_motor.place_it()
-        move_motor.reset_motors()
-    else:
-        print("Error: Could not find valid angles for the given target.")
+    return angles
+
+def main():
+    with tracing.span("cycle"):
+        with tracing.span("find target"):
+            angles = find_target()
+        if angles:
+            pick_and_place(*angles)
+        else:
+            print("Error: Could not find valid angles for the given target.")
+
+# Function to plan one pick for every marker, returns [(marker id, angles)] for the reachable ones
+def plan_picks(markers):
+    plan = []
+    for marker_id, (x, y, z) in sorted(markers.items()):
+        if not in_reach(x, y, z):
+            print(f"Marker {marker_id} is out of reach.")
+            continue
+        angles = get_motor_angles(*correct_target(x, y, z))
+        if angles:
+            plan.append((marker_id, angles))
+        else:
+            print(f"Error: Could not find valid angles for marker {marker_id}.")
+    return plan
+
+# Same as main() but for every block in view, all planned from one frame
+def main_all():
+    for marker_id, angles in plan_picks(camera.get_all_marker_coordinates()):
+        print(f"Picking up marker {marker_id}")
+        pick_and_place(*angles)
+
+# Function to find the next block that is not in exclude (marker ids already picked) and solve its IK.
+# Returns (marker id, angles), angles None if it is out of reach, or None when no other block is in view.
+def find_next_target(exclude=()):
+    with tracing.span("find target"):
+        found = camera.get_stable_marker(exclude)
+        if found is None:
+            return None
+        marker_id, (x, y, z) = found
+        if not in_reach(x, y, z):
+            print(f"Marker {marker_id} is out of reach.")
+            return marker_id, None
+        angles = get_motor_angles(*correct_target(x, y, z))
+        if not angles:
+            print(f"Error: Could not find valid angles for marker {marker_id}.")
+        return marker_id, angles
+
+# Function to keep picking blocks until there are none left in view (or max_picks), without a voice
+# command for each. With pipelined=True the next block is searched and solved in a worker thread while
+# the arm places the last one and comes back, so the next pick starts as soon as the arm is home.
+# on_pick(marker id) is called once a block is lifted. Returns the statistics, times in seconds:
+#   picks, skipped (unreachable marker ids), elapsed, picks_per_minute,
+#   vision_busy / vision_idle     searching and solving / waiting to be asked
+#   motion_busy / motion_idle     moving / waiting (motion_waiting: of that, waiting for the vision)
+def run_continuous(max_picks=None, pipelined=True, on_pick=None):
+    load_workspace()
+    ik_table.load_table()
+    clock = hardware.get_clock()
+    stats = {"picks": 0, "skipped": [], "vision_busy": 0.0, "motion_busy": 0.0, "motion_waiting": 0.0}
+    picked = set()
+
+    def look(exclude):
+        started = clock.now()
+        try:
+            return find_next_target(exclude)
+        finally:
+            stats["vision_busy"] += clock.now() - started
+
+    start = clock.now()
+    move_motor.reset_motors()
+    stats["motion_busy"] += clock.now() - start
+    with ThreadPoolExecutor(max_workers=1) as worker:
+        upcoming = worker.submit(look, set(picked))
+        looked_while_moving = False
+        while max_picks is None or stats["picks"] < max_picks:
+            waiting = clock.now()
+            target = upcoming.result()
+            if target is None and looked_while_moving:
+                # The arm was in front of the camera during that look, look again now that it is home
+                target = worker.submit(look, set(picked)).result()
+            stats["motion_waiting"] += clock.now() - waiting
+            if target is None:
+                break
+            looked_while_moving = False
+            marker_id, angles = target
+            picked.add(marker_id)
+            if not angles:
+                stats["skipped"].append(marker_id)
+                upcoming = worker.submit(look, set(picked))
+                continue
+
+            moving = clock.now()
+            with tracing.span("pick", {"marker": marker_id}):
+                grab(*angles)
+            if on_pick is not None:
+                on_pick(marker_id)
+            if pipelined:
+                # The block is in the gripper, look for the next one while it is carried away
+                upcoming = worker.submit(look, set(picked))
+                looked_while_moving = True
+            with tracing.span("place", {"marker": marker_id}):
+                move_motor.place_it()
+                move_motor.reset_motors()
+            stats["motion_busy"] += clock.now() - moving
+            stats["picks"] += 1
+            if not pipelined:
+                upcoming = worker.submit(look, set(picked))
+
+    elapsed = clock.now() - start
+    stats["elapsed"] = elapsed
+    stats["picks_per_minute"] = stats["picks"] / elapsed * 60 if elapsed > 0 else 0.0
+    stats["vision_idle"] = elapsed - stats["vision_busy"]
+    stats["motion_idle"] = elapsed - stats["motion_busy"]
+    print(f"{stats['picks']} picks in {elapsed:.1f} s ({stats['picks_per_minute']:.2f} per minute), "
+          f"arm idle {stats['motion_idle']:.1f} s ({stats['motion_waiting']:.1f} s of it waiting for the camera), "
+          f"camera idle {stats['vision_idle']:.1f} s")
+    return stats
+
+# Function to run the voice, vision and motion tasks side by side (see coordinator.py)
+def run():
+    # Reachability map and IK table now, not when the first block is seen
+    load_workspace()
+    ik_table.load_table()
+    # Offline keyword spotting if ROBOTIC_ARM_OFFLINE_SPEECH=1, otherwise Google speech recognition
+    listen = hardware.get_microphone()
+    if hardware.BACKEND == "real":
+        # Render the two messages spoken every cycle now, so they play without starting espeak each time
+        prerender([ACTIVATING_MESSAGE, READY_MESSAGE])
+    arm = Coordinator(listen, hardware.get_speaker(), find_target,
+                      lambda *angles: pick_and_place(*angles, reset=False), reset=move_motor.reset_motors,
+                      commands={"pick them all": main_all, "keep picking": run_continuous})
+    asyncio.run(arm.run())
+
+# Function to compare the continuous mode with and without the look-ahead on the simulated camera and
+# servos, with a few blocks in front of the camera. Runs on a clock 5x faster than real time.
+# occluding=True hides every block from the camera from the pick until the arm is home again, like the
+# arm does when it carries a block through the view.
+def simulate_continuous(blocks=((-0.05, 0.02, 0.25), (0.03, 0.02, 0.22), (0.0, 0.02, 0.30), (0.06, 0.02, 0.27)),
+                        occluding=False):
+    from clock import ScaledClock
+
+    reset_motors = move_motor.reset_motors
+    results = {}
+    for pipelined in (False, True):
+        hardware.use_simulator(clock=ScaledClock(5))
+        move_motor.engine = None
+        move_motor.motion = None
+        scene = hardware.get_camera()
+        for marker_id, position in enumerate(blocks):
+            scene.place(marker_id, position)
+        camera.stop_capture()
+        camera.tracker.reset()
+        remaining = dict(enumerate(blocks))
+
+        def picked(marker_id):
+            del remaining[marker_id]
+            for hidden in (remaining if occluding else {}):
+                scene.remove(hidden)
+            scene.remove(marker_id)
+
+        def home():
+            reset_motors()
+            for marker_id, position in remaining.items():
+                scene.place(marker_id, position)
+
+        move_motor.reset_motors = home
+        try:
+            print("Pipelined:" if pipelined else "In series:")
+            results[pipelined] = run_continuous(pipelined=pipelined, on_pick=picked)
+        finally:
+            move_motor.reset_motors = reset_motors
+    camera.stop_capture()
+    return results
 
 if __name__ == "__main__":
-    while True:
-        recognized_text = listen_to_microphone()
-        if recognized_text == "activate now":
-            speak_text("Please, wait,    The arm, is, activating!")
-            main()
-            speak_text("I  am, ready, to, go, again!")
+    if "--sim" in sys.argv:
+        for pipelined, stats in simulate_continuous().items():
+            print(f"{'Pipelined' if pipelined else 'In series'}: {stats['picks']} picks, "
+                  f"{stats['picks_per_minute']:.2f} picks per minute, arm waited {stats['motion_waiting']:.1f} s for the camera, "
+                  f"camera idle {stats['vision_idle']:.1f} s of {stats['elapsed']:.1f} s")
+            assert stats["picks"] == 4, f"{stats['picks']} of 4 blocks picked"
+        # A look-ahead that sees nothing while the arm blocks the view must not end the run
+        for pipelined, stats in simulate_continuous(occluding=True).items():
+            assert stats["picks"] == 4, f"{stats['picks']} of 4 blocks picked with the arm in the view"
+    elif "--continuous" in sys.argv:
+        run_continuous()
+    else:
+        run()
@@ -1,6 +1,16 @@
-import speech_recognition as sr
+import json
+import os
+import sys
+import time
+import wave
+from collections import deque
+import numpy as np
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 def listen_to_microphone():
+    import speech_recognition as sr
+
     r = sr.Recognizer()
 
     # Specify the correct microphone by index
@@ -14,7 +24,7 @@ def listen_to_microphone():
             try:
                 # Adjust for ambient noise for better accuracy
                 r.adjust_for_ambient_noise(source)
-                
+
                 # Listen and recognize
                 audio = r.listen(source)
                 words = r.recognize_google(audio)
@@ -28,3 +38,251 @@ def listen_to_microphone():
                 print("Could not request results; check your internet connection")
                 internet_message = "Could not request results; check your internet connection"
                 return internet_message
+
+
+# Offline command recognition.
+#
+# listen_to_microphone() measures the room noise for a second before every utterance and sends every
+# utterance to Google, just to check for one fixed phrase. The local mode below measures the noise
+# once and keeps updating it from the quiet parts, streams the audio in small chunks into a keyword
+# recognizer running on the Pi (Vosk, limited to the command phrases) and returns the moment the
+# phrase is heard, without waiting for the speaker to stop.
+
+# Set ROBOTIC_ARM_OFFLINE_SPEECH=1 to have arm.py listen with the local mode
+OFFLINE = os.environ.get("ROBOTIC_ARM_OFFLINE_SPEECH") == "1"
+# Vosk model directory (e.g. vosk-model-small-en-us from alphacephei.com/vosk/models)
+VOSK_MODEL_PATH = os.environ.get("ROBOTIC_ARM_VOSK_MODEL", os.path.join(MODULE_DIR, "vosk-model-small-en-us"))
+
+PHRASES = ["activate now", "pick them all", "keep picking"]
+RATE = 16000
+CHUNK = 1024  # Samples per chunk, 64 ms at 16 kHz
+
+
+# Chunks of 16-bit mono audio from the USB microphone
+class MicrophoneSource:
+    def __init__(self, device_index=2, rate=RATE, chunk=CHUNK):
+        import pyaudio
+
+        self.rate = rate
+        self.chunk = chunk
+        self.position = 0.0  # Seconds of audio read so far
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(format=pyaudio.paInt16, channels=1, rate=rate, input=True,
+                                      input_device_index=device_index, frames_per_buffer=chunk)
+
+    def read(self):
+        data = self.stream.read(self.chunk, exception_on_overflow=False)
+        self.position += self.chunk / self.rate
+        return data
+
+
+# Chunks from a 16-bit mono WAV file, in place of the microphone. Returns None at the end of the file.
+class WavSource:
+    def __init__(self, path, chunk=CHUNK, realtime=False):
+        self.wav = wave.open(path, "rb")
+        if self.wav.getsampwidth() != 2 or self.wav.getnchannels() != 1:
+            raise ValueError(f"{path} has to be 16-bit mono")
+        self.rate = self.wav.getframerate()
+        self.chunk = chunk
+        self.realtime = realtime  # Take as long as the microphone would
+        self.position = 0.0
+
+    def read(self):
+        data = self.wav.readframes(self.chunk)
+        if not data:
+            return None
+        if self.realtime:
+            time.sleep(self.chunk / self.rate)
+        self.position += len(data) / 2 / self.rate
+        return data
+
+
+# Keyword recognizer on the Pi, only listens for the given phrases
+class VoskMatcher:
+    def __init__(self, phrases=PHRASES, rate=RATE, model_path=VOSK_MODEL_PATH):
+        import vosk
+
+        self.phrases = phrases
+        self.recognizer = vosk.KaldiRecognizer(vosk.Model(model_path), rate, json.dumps(phrases + ["[unk]"]))
+
+    # Function to add a chunk of audio, returns the phrase as soon as it was heard, otherwise None
+    def feed(self, chunk):
+        if self.recognizer.AcceptWaveform(chunk):
+            text = json.loads(self.recognizer.Result())["text"]
+        else:
+            text = json.loads(self.recognizer.PartialResult())["partial"]
+        for phrase in self.phrases:
+            if phrase in text:
+                self.recognizer.Reset()
+                return phrase
+        return None
+
+    def reset(self):
+        self.recognizer.Reset()
+
+
+# Stand-in for VoskMatcher without vosk or a model: "hears" phrase once it has been fed speech_time
+# seconds of audio louder than min_energy since the last reset, for checking the segmentation and
+# timing of LocalListener on WAV files
+class FakeMatcher:
+    def __init__(self, phrase=PHRASES[0], speech_time=0.5, rate=RATE, min_energy=300):
+        self.phrase = phrase
+        self.samples = int(speech_time * rate)
+        self.min_energy = min_energy
+        self.heard = 0
+
+    def feed(self, chunk):
+        samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+        if len(samples) and np.sqrt(np.mean(samples**2)) > self.min_energy:
+            self.heard += len(samples)
+        if self.heard >= self.samples:
+            self.heard = 0
+            return self.phrase
+        return None
+
+    def reset(self):
+        self.heard = 0
+
+
+class LocalListener:
+    def __init__(self, source, matcher, calibration_time=0.5, speech_ratio=3.0, min_energy=300,
+                 silence_time=0.8):
+        self.source = source
+        self.matcher = matcher
+        self.calibration_chunks = max(1, round(calibration_time * source.rate / source.chunk))
+        self.silence_chunks = max(1, round(silence_time * source.rate / source.chunk))
+        self.speech_ratio = speech_ratio  # Louder than the noise by this much counts as speech
+        self.min_energy = min_energy
+        self.noise = None  # Noise energy, measured once and then kept up to date
+        self.speech_started_at = None
+        self.detected_at = None
+
+    def _energy(self, chunk):
+        samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+        return float(np.sqrt(np.mean(samples**2))) if len(samples) else 0.0
+
+    def calibrate(self):
+        energies = []
+        for _ in range(self.calibration_chunks):
+            chunk = self.source.read()
+            if chunk is None:
+                break
+            energies.append(self._energy(chunk))
+        self.noise = float(np.mean(energies)) if energies else 0.0
+
+    # Function to listen until one of the phrases is heard and return it ("" if the audio ran out).
+    # Afterwards speech_started_at and detected_at tell when (in seconds of audio) it happened.
+    def listen(self):
+        if self.noise is None:
+            self.calibrate()
+
+        preroll = deque(maxlen=3)  # Chunks before the speech started, so the first word is not cut
+        in_speech = False
+        quiet = 0
+        while True:
+            chunk = self.source.read()
+            if chunk is None:
+                return ""
+
+            energy = self._energy(chunk)
+            loud = energy > max(self.noise * self.speech_ratio, self.min_energy)
+            if not loud:
+                self.noise = 0.95 * self.noise + 0.05 * energy  # Follow slow changes of the room noise
+
+            if not in_speech:
+                if not loud:
+                    preroll.append(chunk)
+                    continue
+                in_speech = True
+                quiet = 0
+                self.speech_started_at = self.source.position - len(chunk) / 2 / self.source.rate
+                for earlier in preroll:
+                    self.matcher.feed(earlier)
+                preroll.clear()
+
+            phrase = self.matcher.feed(chunk)
+            if phrase:
+                self.detected_at = self.source.position
+                print(f"You said: {phrase}")
+                return phrase
+
+            quiet = 0 if loud else quiet + 1
+            if quiet >= self.silence_chunks:
+                # End of the utterance and no phrase in it, start over
+                in_speech = False
+                self.matcher.reset()
+
+
+_listener = None
+
+# Same as listen_to_microphone() but offline, returns as soon as a command phrase was heard
+def listen_locally():
+    global _listener
+    if _listener is None:
+        source = MicrophoneSource()
+        _listener = LocalListener(source, VoskMatcher(rate=source.rate))
+        print("Start talking!")
+    return _listener.listen()
+
+
+# Function to write a 16-bit mono WAV file of room noise with loud parts (a tone) at the given
+# (start, end) seconds, in place of a recording
+def _synthetic_wav(path, duration, loud=(), rate=RATE):
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 50, int(duration * rate))
+    t = np.arange(len(samples)) / rate
+    for start, end in loud:
+        part = (t >= start) & (t < end)
+        samples[part] += 3000 * np.sin(2 * np.pi * 220 * t[part])
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.clip(samples, -32768, 32767).astype(np.int16).tobytes())
+
+
+def _listen_to_file(path, matcher):
+    source = WavSource(path)
+    listener = LocalListener(source, matcher(source.rate))
+    start = time.perf_counter()
+    phrase = listener.listen()
+    elapsed = time.perf_counter() - start
+    if phrase:
+        print(f"{path}: '{phrase}' at {listener.detected_at:.2f} s of audio, "
+              f"{listener.detected_at - listener.speech_started_at:.2f} s after the speech started, "
+              f"{elapsed:.2f} s to process")
+    else:
+        print(f"{path}: no command heard")
+    return phrase, listener
+
+
+if __name__ == "__main__":
+    # Feed WAV files through the local mode and report how fast the phrase was picked up. Without vosk
+    # FakeMatcher stands in for the recognizer. Without files, checks the segmentation on generated
+    # ones: room noise only, a short cough, and 1.2 s of speech starting at 1.5 s.
+    import importlib.util
+
+    if importlib.util.find_spec("vosk") is not None:
+        matcher = lambda rate: VoskMatcher(rate=rate)
+    else:
+        print("vosk is not installed, FakeMatcher hears a command after 0.5 s of speech")
+        matcher = lambda rate: FakeMatcher(rate=rate)
+
+    if sys.argv[1:]:
+        for path in sys.argv[1:]:
+            _listen_to_file(path, matcher)
+        sys.exit()
+
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    expected = {"noise.wav": ((), False), "cough.wav": (((1.5, 1.7),), False), "command.wav": (((1.5, 2.7),), True)}
+    for name, (loud, command) in expected.items():
+        path = os.path.join(directory, name)
+        _synthetic_wav(path, 4.0, loud)
+        phrase, listener = _listen_to_file(path, lambda rate: FakeMatcher(rate=rate))
+        assert bool(phrase) == command, f"{name}: heard '{phrase}'"
+        if command:
+            chunk = CHUNK / RATE
+            assert abs(listener.speech_started_at - loud[0][0]) <= chunk, f"{name}: speech started at {listener.speech_started_at:.2f} s"
+            assert listener.detected_at - loud[0][0] <= 0.5 + chunk, f"{name}: heard at {listener.detected_at:.2f} s"
@@ -1,4 +1,231 @@
+import hashlib
+import os
+import queue
 import subprocess
+import threading
+import time
+from collections import OrderedDict
+import tracing
 
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Speech output that does not start espeak again for every message.
+#
+# Each phrase is rendered to WAV once and kept in a cache (in memory, and on disk so it survives a
+# restart), arm.py renders its fixed messages up front. Messages are queued and played one after the
+# other by a worker thread, so the caller does not have to wait; text that is not cached yet is
+# rendered by the worker too.
+
+CACHE_DIR = os.path.join(MODULE_DIR, "speech_cache")
+CACHE_BYTES = 8 * 1024 * 1024  # Rendered audio kept in memory
+CACHE_FILES = 50  # Rendered phrases kept on disk
+
+
+# espeak writing WAV to stdout instead of the speaker
+class EspeakSynthesizer:
+    def __call__(self, text):
+        return subprocess.run(["espeak", "--stdout", text], capture_output=True, check=True).stdout
+
+
+class AplayPlayer:
+    def __call__(self, wav):
+        subprocess.run(["aplay", "-q", "-"], input=wav, check=True)
+
+
+# Least recently used cache of rendered phrases, limited by bytes in memory and by files on disk
+class PhraseCache:
+    def __init__(self, max_bytes=CACHE_BYTES, directory=None, max_files=CACHE_FILES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, text):
+        return os.path.join(self.directory, hashlib.sha1(text.encode()).hexdigest() + ".wav")
+
+    def get(self, text):
+        with self.lock:
+            wav = self.entries.get(text)
+            if wav is not None:
+                self.entries.move_to_end(text)
+        if wav is None and self.directory and os.path.exists(self._path(text)):
+            with open(self._path(text), "rb") as f:
+                wav = f.read()
+            self._remember(text, wav)
+        if wav is not None and self.directory:
+            self._touch(text)
+        return wav
+
+    # Function to mark the file of a phrase as just used, the files are evicted by modification time
+    def _touch(self, text):
+        try:
+            os.utime(self._path(text))
+        except OSError:
+            pass  # Evicted from disk, it is still in memory
+
+    def put(self, text, wav):
+        self._remember(text, wav)
+        if self.directory:
+            with open(self._path(text), "wb") as f:
+                f.write(wav)
+            self._evict_files()
+
+    def _remember(self, text, wav):
+        with self.lock:
+            if text in self.entries:
+                self.size -= len(self.entries.pop(text))
+            self.entries[text] = wav
+            self.size += len(wav)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _evict_files(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".wav")]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:max(0, len(paths) - self.max_files)]:
+            os.remove(path)
+
+
+class SpeechService:
+    def __init__(self, synthesizer=None, player=None, cache=None):
+        self.synthesizer = synthesizer or EspeakSynthesizer()
+        self.player = player or AplayPlayer()
+        self.cache = cache if cache is not None else PhraseCache(directory=CACHE_DIR)
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    # Function to queue a message, returns an event that is set once it has been spoken
+    def say(self, text):
+        done = threading.Event()
+        self.queue.put((text, True, done))
+        return done
+
+    # Function to render messages ahead of time so they play without delay later
+    def prerender(self, texts):
+        for text in texts:
+            self.queue.put((text, False, None))
+
+    # Function to wait until everything queued has been spoken
+    def wait(self):
+        self.queue.join()
+
+    def render(self, text):
+        wav = self.cache.get(text)
+        if wav is None:
+            wav = self.synthesizer(text)
+            self.cache.put(text, wav)
+        return wav
+
+    def _run(self):
+        while True:
+            text, play, done = self.queue.get()
+            try:
+                with tracing.span("tts render", {"text": text}):
+                    wav = self.render(text)
+                if play:
+                    with tracing.span("tts play", {"text": text}):
+                        self.player(wav)
+            except Exception as error:
+                # Whatever went wrong, the worker has to keep going or every later message waits forever
+                print(f"Could not speak '{text}': {error}")
+            finally:
+                if done is not None:
+                    done.set()
+                self.queue.task_done()
+
+
+_service = None
+
+def get_service():
+    global _service
+    if _service is None:
+        _service = SpeechService()
+    return _service
+
+# Function to speak a message and wait until it has been said
 def speak_text(text):
-    subprocess.run(["espeak", text])
+    get_service().say(text).wait()
+
+# Function to speak a message without waiting for it
+def speak_text_async(text):
+    return get_service().say(text)
+
+def prerender(texts):
+    get_service().prerender(texts)
+
+
+# Synthesizer and player that only count and take time like the real ones would
+class FakeSynthesizer:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, text):
+        time.sleep(self.delay)
+        self.calls += 1
+        return text.encode() * 1000
+
+
+class FakePlayer:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.played = []
+
+    def __call__(self, wav):
+        time.sleep(self.delay)
+        self.played.append(wav)
+
+
+if __name__ == "__main__":
+    # Five cycles of arm.py's two messages with a fake 0.3 s espeak: how often it renders and how long
+    # the caller is blocked
+    synthesizer = FakeSynthesizer(delay=0.3)
+    service = SpeechService(synthesizer, FakePlayer(delay=0.1), PhraseCache())
+    messages = ["Please, wait,    The arm, is, activating!", "I  am, ready, to, go, again!"]
+    service.prerender(messages)
+    service.wait()
+
+    start = time.perf_counter()
+    for _ in range(5):
+        for message in messages:
+            service.say(message)
+    blocked = time.perf_counter() - start
+    service.wait()
+    print(f"Rendered {synthesizer.calls} times for {5 * len(messages)} messages "
+          f"(espeak used to run {5 * len(messages)} times), caller blocked for {blocked * 1000:.2f} ms")
+    assert synthesizer.calls == len(messages), f"rendered {synthesizer.calls} times"
+    assert blocked < synthesizer.delay, "the caller waited for the speech"
+
+    # A message that fails to render must not stop the worker
+    def failing(text):
+        if text == "broken":
+            raise ValueError("no voice")
+        return text.encode()
+
+    player = FakePlayer()
+    service = SpeechService(failing, player, PhraseCache())
+    service.say("broken")
+    assert service.say("still speaking").wait(timeout=5), "the worker died on a failed message"
+    assert player.played == [b"still speaking"]
+
+    # Files on disk are evicted least recently used first, reading one from disk counts as using it
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    cache = PhraseCache(directory=directory, max_files=2)
+    cache.put("first", b"1")
+    time.sleep(0.01)
+    cache.put("second", b"2")
+    time.sleep(0.01)
+    assert PhraseCache(directory=directory, max_files=2).get("first") == b"1"  # Fresh memory, from disk
+    time.sleep(0.01)
+    cache.put("third", b"3")
+    fresh = PhraseCache(directory=directory, max_files=2)
+    assert fresh.get("first") == b"1" and fresh.get("second") is None, "evicted the phrase that was just used"
+    print("Failed messages keep the worker running, disk cache evicts least recently used")
@@ -1,4 +1,8 @@
+import contextlib
+import io
 import math
+import time
+import numpy as np
 
 
 BASE_OFFSET = 90
@@ -96,8 +100,207 @@ def calculate(x, y, z):
             except ValueError:
                 pass  # Ignore math domain errors and continue adjusting G_z
 
-        else:
-            # Increase G_z by 1% of Z to adjust the gripper position and recalculate
-            G_z += 0.01 * z
+        # Increase G_z by 1% of Z to adjust the gripper position and recalculate
+        # (also when the angles were out of range, otherwise the loop never ends)
+        G_z += 0.01 * z
+        if z <= 0:
+            break  # G_z can not grow past a zero/negative Z, nothing left to try
 
     print("Error: Could not find valid angles for the given target.")
+
+
+# Same search as calculate() but for many targets at once, points is an (N, 3) array of (x, y, z).
+# Returns an (N, 4) array of (base, shoulder, elbow, wrist) angles, NaN where no valid angles were
+# found, and a mask of the targets that are reachable.
+def calculate_batch(points):
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    x = points[:, 0]
+    z = points[:, 2]
+    angles = np.full((len(points), 4), np.nan)
+    reachable = np.zeros(len(points), dtype=bool)
+
+    # Base angle, same adjustment around BASE_OFFSET as calculate()
+    theta_base_deg = np.degrees(np.arctan2(np.abs(x), np.abs(z)))
+    theta_base_deg = np.where(x >= 0, BASE_OFFSET - theta_base_deg, BASE_OFFSET + theta_base_deg)
+    angles[:, 0] = np.clip(theta_base_deg, BASE_MIN, BASE_MAX)
+
+    shoulder_to_target_distance_after_base_rotated = np.sqrt(np.abs(x)**2 + z**2)
+    G_y = GRIPPER_LENGTH
+    shoulder_to_target_y = L1 - G_y
+    y_diff_neg = shoulder_to_target_y < 0
+
+    # Every target walks its own G_z in steps of 1% of its z, only the ones still searching are computed
+    G_z = np.zeros(len(points))
+    searching = np.flatnonzero(G_z <= z)
+    while len(searching):
+        g_z = G_z[searching]
+        shoulder_to_target_z = shoulder_to_target_distance_after_base_rotated[searching] - g_z
+        hypotenuse = np.sqrt(shoulder_to_target_y**2 + shoulder_to_target_z**2)
+
+        cos_theta_elbow = np.clip((L2**2 + L3**2 - hypotenuse**2) / (2 * L2 * L3), -1, 1)
+        theta_elbow_deg = np.degrees(np.arccos(cos_theta_elbow))
+
+        cos_theta_shoulder = np.clip((L2**2 + hypotenuse**2 - L3**2) / (2 * L2 * hypotenuse), -1, 1)
+        theta_shoulder = np.arccos(cos_theta_shoulder)
+        if y_diff_neg:
+            incline_angle = np.degrees(np.arctan2(abs(shoulder_to_target_y), shoulder_to_target_z))
+            theta_shoulder_deg = np.degrees(theta_shoulder) + incline_angle + 90
+        else:
+            incline_angle = np.degrees(np.arctan2(shoulder_to_target_z, shoulder_to_target_y))
+            theta_shoulder_deg = np.degrees(theta_shoulder) + incline_angle
+
+        theta_wrist_deg = np.clip(np.degrees(np.arctan2(g_z, G_y)), WRIST_MIN, WRIST_MAX)
+
+        valid = ((shoulder_to_target_z <= (L2 + L3))
+                 & (SHOULDER_MIN <= theta_shoulder_deg) & (theta_shoulder_deg <= SHOULDER_MAX)
+                 & (ELBOW_MIN <= theta_elbow_deg) & (theta_elbow_deg <= ELBOW_MAX))
+        done = searching[valid]
+        angles[done, 1] = theta_shoulder_deg[valid] - 85
+        angles[done, 2] = 245 - theta_elbow_deg[valid]
+        angles[done, 3] = theta_wrist_deg[valid]
+        reachable[done] = True
+
+        # Step the rest, a zero/negative z can not step so it is done as well
+        searching = searching[~valid & (z[searching] > 0)]
+        G_z[searching] += 0.01 * z[searching]
+        searching = searching[G_z[searching] <= z[searching]]
+
+    return angles, reachable
+
+
+# Shoulder, elbow and wrist angles (before the servo offsets) for a given G_z, same geometry as calculate()
+def _joint_angles(radius, G_z, G_y=GRIPPER_LENGTH):
+    shoulder_to_target_y = L1 - G_y
+    shoulder_to_target_z = radius - G_z
+    hypotenuse = math.sqrt(shoulder_to_target_y**2 + shoulder_to_target_z**2)
+
+    cos_theta_elbow = max(-1, min(1, (L2**2 + L3**2 - hypotenuse**2) / (2 * L2 * L3)))
+    theta_elbow_deg = math.degrees(math.acos(cos_theta_elbow))
+
+    cos_theta_shoulder = max(-1, min(1, (L2**2 + hypotenuse**2 - L3**2) / (2 * L2 * hypotenuse)))
+    theta_shoulder = math.acos(cos_theta_shoulder)
+    if shoulder_to_target_y < 0:
+        incline_angle = math.degrees(math.atan2(abs(shoulder_to_target_y), shoulder_to_target_z))
+        theta_shoulder_deg = math.degrees(theta_shoulder) + incline_angle + 90
+    else:
+        incline_angle = math.degrees(math.atan2(shoulder_to_target_z, shoulder_to_target_y))
+        theta_shoulder_deg = math.degrees(theta_shoulder) + incline_angle
+
+    theta_wrist_deg = max(WRIST_MIN, min(WRIST_MAX, math.degrees(math.atan2(G_z, G_y))))
+    return theta_shoulder_deg, theta_elbow_deg, theta_wrist_deg
+
+
+def _angles_valid(radius, G_z):
+    if radius - G_z > L2 + L3:
+        return False
+    theta_shoulder_deg, theta_elbow_deg, _ = _joint_angles(radius, G_z)
+    return SHOULDER_MIN <= theta_shoulder_deg <= SHOULDER_MAX and ELBOW_MIN <= theta_elbow_deg <= ELBOW_MAX
+
+
+# Function to find the smallest G_z that gives valid angles without stepping through it.
+# The arm reaches the target once radius - G_z <= L2 + L3, so that is the answer whenever the angles
+# are in range there. Otherwise the range is found by bisection, down to tolerance (in inches).
+# Returns None if no G_z between 0 and z works.
+def solve_g_z(x, z, tolerance=1e-6):
+    if z < 0:
+        return None
+    radius = math.sqrt(abs(x)**2 + z**2)
+
+    low = max(0.0, radius - (L2 + L3))
+    if low > z:
+        return None  # Out of reach even with the gripper at its full length
+    if _angles_valid(radius, low):
+        return low
+    if not _angles_valid(radius, z):
+        return None
+
+    # low is invalid and z is valid, close in on the first valid G_z
+    high = z
+    while high - low > tolerance:
+        middle = (low + high) / 2
+        if _angles_valid(radius, middle):
+            high = middle
+        else:
+            low = middle
+    return high
+
+
+# Same result as calculate() but with G_z solved directly (see solve_g_z()) instead of the 1% search,
+# so the angles match within one search step and the cost does not grow with the distance
+def calculate_exact(x, y, z, tolerance=1e-6):
+    G_z = solve_g_z(x, z, tolerance)
+    if G_z is None:
+        print("Error: Could not find valid angles for the given target.")
+        return None
+
+    theta_base_deg = math.degrees(math.atan2(abs(x), abs(z)))
+    if x >= 0:
+        theta_base_deg = BASE_OFFSET - theta_base_deg
+    else:
+        theta_base_deg = BASE_OFFSET + theta_base_deg
+    theta_base_deg = max(BASE_MIN, min(BASE_MAX, theta_base_deg))
+
+    theta_shoulder_deg, theta_elbow_deg, theta_wrist_deg = _joint_angles(math.sqrt(abs(x)**2 + z**2), G_z)
+    return theta_base_deg, theta_shoulder_deg - 85, 245 - theta_elbow_deg, theta_wrist_deg
+
+
+if __name__ == "__main__":
+    # Benchmark calculate_batch() against calling calculate() in a loop
+    rng = np.random.default_rng(0)
+    points = np.column_stack([rng.uniform(-15, 15, 5000), np.zeros(5000), rng.uniform(0.5, 20, 5000)])
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [calculate(x, y, z) for x, y, z in points]
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    angles, reachable = calculate_batch(points)
+    batch_time = time.perf_counter() - start
+
+    same = all((e is None and not r) or (r and np.allclose(e, a)) for e, a, r in zip(expected, angles, reachable))
+    print(f"calculate() loop:  {loop_time * 1000:.1f} ms for {len(points)} targets")
+    print(f"calculate_batch(): {batch_time * 1000:.1f} ms ({loop_time / batch_time:.0f}x faster)")
+    print(f"Reachable: {reachable.sum()} / {len(points)}, same angles as calculate(): {same}")
+
+    # Check calculate_exact() against calculate() over a dense grid of targets. calculate() lands on the
+    # first 1% step past the exact G_z, so its angles have to lie between the exact ones and the ones
+    # one step further out.
+    checked = 0
+    failures = 0
+    edge_cases = 0
+    legacy_time = 0.0
+    exact_time = 0.0
+    for x in np.arange(-15, 15.01, 0.25):
+        for z in np.arange(0.25, 20.01, 0.25):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = calculate(x, 0, z)
+            legacy_time += time.perf_counter() - start
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = calculate_exact(x, 0, z)
+            exact_time += time.perf_counter() - start
+
+            checked += 1
+            if expected is None and result is not None and solve_g_z(x, z) > 0.99 * z:
+                # calculate() adds up 0.01 * z a hundred times and can step just past G_z = z
+                edge_cases += 1
+                continue
+            if expected is None or result is None:
+                failures += (expected is None) != (result is None)
+                continue
+            radius = math.sqrt(x**2 + z**2)
+            G_z = solve_g_z(x, z)
+            first = _joint_angles(radius, G_z)
+            last = _joint_angles(radius, min(z, G_z + 0.01 * z))
+            bounds = [(first[0] - 85, last[0] - 85), (245 - first[1], 245 - last[1]), (first[2], last[2])]
+            for value, (a, b) in zip(expected[1:], bounds):
+                if not min(a, b) - 1e-6 <= value <= max(a, b) + 1e-6:
+                    failures += 1
+                    break
+
+    print(f"calculate_exact() vs calculate(): {failures} mismatches over {checked} targets")
+    print(f"Targets only calculate_exact() reaches (G_z within the last 1% step): {edge_cases}")
+    print(f"calculate() loop: {legacy_time * 1000:.1f} ms, calculate_exact(): {exact_time * 1000:.1f} ms")
+    assert failures == 0, f"calculate_exact() disagrees with calculate() on {failures} targets"
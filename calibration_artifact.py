@@ -0,0 +1,131 @@
+import os
+import struct
+import time
+import cv2
+import numpy as np
+
+# Camera calibration in one binary file: the intrinsics together with the undistortion/rectification
+# maps for the capture resolution, so nothing about the lens distortion has to be computed at run time.
+#
+# Layout (little endian):
+#   header   magic, width, height, camera matrix (9 x f8), distortion (5 x f8), rectified camera matrix (9 x f8)
+#   map1     int16   (height, width, 2)  from initUndistortRectifyMap with CV_16SC2
+#   map2     uint16  (height, width)
+# The maps are memory mapped on load, so loading only reads the header.
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where the artifact lives, can be changed with the ROBOTIC_ARM_CALIBRATION environment variable
+DEFAULT_PATH = os.environ.get("ROBOTIC_ARM_CALIBRATION", os.path.join(MODULE_DIR, "calibration.bin"))
+
+CAPTURE_SIZE = (1920, 1080)
+
+MAGIC = b"ARMCAL01"
+HEADER = struct.Struct("<8sII9d5d9d")
+HEADER_SIZE = 256  # Header padded so the maps start aligned
+
+
+class Calibration:
+    def __init__(self, size, camera_matrix, dist_coeffs, new_camera_matrix, map1, map2):
+        self.size = size
+        self.camera_matrix = camera_matrix
+        self.dist_coeffs = dist_coeffs
+        self.new_camera_matrix = new_camera_matrix  # Camera matrix of the rectified frame
+        self.no_distortion = np.zeros(5)  # Distortion of the rectified frame
+        self.map1 = map1
+        self.map2 = map2
+        self.buffer = None
+
+    # Function to undistort a frame with the precomputed maps, into a buffer reused between calls
+    def rectify(self, frame):
+        if self.buffer is None or self.buffer.shape != frame.shape:
+            self.buffer = np.empty_like(frame)
+        return cv2.remap(frame, self.map1, self.map2, cv2.INTER_LINEAR, dst=self.buffer)
+
+    # Function to move points found in the captured frame (e.g. marker corners) to the rectified frame.
+    # For a few points solving the distortion model is as fast as any lookup table.
+    def rectify_points(self, points):
+        points = np.asarray(points, dtype=np.float32)
+        rectified = cv2.undistortPoints(points.reshape(-1, 1, 2), self.camera_matrix, self.dist_coeffs,
+                                        P=self.new_camera_matrix)
+        return rectified.reshape(points.shape)
+
+
+# Function to compute the maps for a calibration and write the artifact
+def save(camera_matrix, dist_coeffs, size=CAPTURE_SIZE, path=DEFAULT_PATH):
+    camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+    dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).ravel()[:5]
+    width, height = size
+
+    # alpha=0 keeps only valid pixels, so the rectified frame has no black border
+    new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, size, 0, size)
+    map1, map2 = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None, new_camera_matrix, size, cv2.CV_16SC2)
+
+    header = HEADER.pack(MAGIC, width, height, *camera_matrix.ravel(), *dist_coeffs, *new_camera_matrix.ravel())
+    with open(path, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.write(np.ascontiguousarray(map1, dtype=np.int16).tobytes())
+        f.write(np.ascontiguousarray(map2, dtype=np.uint16).tobytes())
+
+
+# Function to load the artifact, the maps are memory mapped and not read until used
+def load(path=DEFAULT_PATH):
+    with open(path, "rb") as f:
+        fields = HEADER.unpack(f.read(HEADER.size))
+    if fields[0] != MAGIC:
+        raise ValueError(f"{path} is not a calibration file")
+
+    width, height = fields[1], fields[2]
+    camera_matrix = np.array(fields[3:12]).reshape(3, 3)
+    dist_coeffs = np.array(fields[12:17])
+    new_camera_matrix = np.array(fields[17:26]).reshape(3, 3)
+
+    map1 = np.memmap(path, dtype=np.int16, mode="r", offset=HEADER_SIZE, shape=(height, width, 2))
+    map2 = np.memmap(path, dtype=np.uint16, mode="r", offset=HEADER_SIZE + map1.nbytes, shape=(height, width))
+    return Calibration((width, height), camera_matrix, dist_coeffs, new_camera_matrix, map1, map2)
+
+
+# Function to load the artifact, building it from camera_matrix.dat and dist_coeffs.dat if it is missing
+def load_or_build(path=DEFAULT_PATH, directory=MODULE_DIR):
+    if not os.path.exists(path):
+        print(f"Calibration file not found at {path}, building it from the .dat files...")
+        camera_matrix = np.loadtxt(os.path.join(directory, "camera_matrix.dat"))
+        dist_coeffs = np.loadtxt(os.path.join(directory, "dist_coeffs.dat"))
+        save(camera_matrix, dist_coeffs, path=path)
+    return load(path)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    camera_matrix = np.loadtxt(os.path.join(MODULE_DIR, "camera_matrix.dat"))
+    dist_coeffs = np.loadtxt(os.path.join(MODULE_DIR, "dist_coeffs.dat"))
+    save(camera_matrix, dist_coeffs)
+    print(f"Wrote {DEFAULT_PATH} ({os.path.getsize(DEFAULT_PATH) / 1e6:.1f} MB) in {time.perf_counter() - start:.2f} s")
+
+    start = time.perf_counter()
+    calibration = load()
+    print(f"Loaded in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    frame = np.zeros((CAPTURE_SIZE[1], CAPTURE_SIZE[0]), dtype=np.uint8)
+    calibration.rectify(frame)
+    start = time.perf_counter()
+    for _ in range(20):
+        calibration.rectify(frame)
+    print(f"Rectify a gray frame: {(time.perf_counter() - start) / 20 * 1000:.2f} ms")
+
+    # Rectified marker corners. Pixels of the rectified frame remapped back through the maps have to
+    # land where they came from (near the middle, the strong lens model folds over at the frame corners),
+    # and sub-pixel corners on the last column must not fall off the edge of the frame.
+    corners = np.array([[[900, 500], [1000, 500], [1000, 600], [900, 600]]], dtype=np.float32)
+    start = time.perf_counter()
+    for _ in range(1000):
+        calibration.rectify_points(corners)
+    print(f"Rectify 4 corners: {(time.perf_counter() - start) / 1000 * 1e6:.1f} us")
+
+    map_x, map_y = cv2.convertMaps(calibration.map1, calibration.map2, cv2.CV_32FC1)
+    error = max(float(np.abs(calibration.rectify_points([[map_x[y, x], map_y[y, x]]]) - (x, y)).max())
+                for x, y in ((960, 540), (400, 300), (1500, 700), (700, 800)))
+    edge = calibration.rectify_points([[1919.0, 540], [1919.4, 540]])
+    jump = float(np.abs(edge[1] - edge[0]).max())
+    print(f"Round trip through the maps: at most {error:.3f} px off, last column moves {jump:.2f} px for 0.4 px")
+    assert error < 1 and jump < 2, "rectify_points() does not agree with the undistortion maps"
@@ -0,0 +1,218 @@
+import functools
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+
+# Camera calibration from a directory of checkerboard images, without the camera.
+#
+# Corner detection is the slow part, so it runs on all cores, and the corners found in every image
+# are cached on disk under a hash of the image content: a second run only looks at images it has not
+# seen yet. The calibration itself is recomputed each time images are added, starting from the last
+# result, and its reprojection error is reported.
+#
+# In the fast mode the board is only searched where a cheap check sees a board-like pattern, first on
+# a downscaled image, then at full resolution if the downscaled search misses it, and only the corner
+# refinement always runs at full resolution.
+
+# Checkerboard dimensions (internal corners)
+CHECKERBOARD = (5, 7)  # (columns-1, rows-1)
+
+# Real-world size of each square on the checkerboard in millimeters
+SQUARE_SIZE = 20  # mm
+
+# Termination criteria for corner subpixel accuracy (max iterations or accuracy threshold)
+criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+# Search the board on an image downscaled by DETECTION_SCALE, then refine at full resolution
+FAST_DETECTION = True
+DETECTION_SCALE = 0.5
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corner_cache")
+
+# Prepare object points based on the real checkerboard layout
+objp = np.zeros((CHECKERBOARD[0] * CHECKERBOARD[1], 3), np.float32)
+objp[:, :2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2)
+objp *= SQUARE_SIZE  # Scale by the square size to get real-world coordinates
+
+
+# Function to find the checkerboard in a gray image, returns its unrefined corners in full resolution
+# coordinates, or None. The fast mode only searches where checkChessboard() (a few ms) sees a board-like
+# pattern: first on the downscaled image, then at full resolution if the downscaled search misses.
+def find_board(gray, fast=FAST_DETECTION):
+    if fast:
+        small = cv2.resize(gray, None, fx=DETECTION_SCALE, fy=DETECTION_SCALE, interpolation=cv2.INTER_AREA)
+        if cv2.checkChessboard(small, CHECKERBOARD):
+            flags = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE
+            ret, corners = cv2.findChessboardCorners(small, CHECKERBOARD, flags)
+            if ret:
+                return corners / DETECTION_SCALE  # Back to full resolution coordinates
+        if not cv2.checkChessboard(gray, CHECKERBOARD):
+            return None
+    ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD, None)
+    return corners if ret else None
+
+
+# Function to find the refined checkerboard corners in one image, returns (corners or None, (width, height))
+def find_corners(path, fast=FAST_DETECTION):
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    size = gray.shape[::-1]
+
+    # Find the checkerboard corners
+    corners = find_board(gray, fast)
+    if corners is None:
+        return None, size
+
+    # Refine corner locations for greater accuracy, always at full resolution
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria), size
+
+
+def image_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class CornerCache:
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        if not os.path.exists(self._path(key)):
+            return None
+        with np.load(self._path(key)) as data:
+            corners = data["corners"] if data["found"] else None
+            return corners, tuple(int(v) for v in data["size"])
+
+    def put(self, key, corners, size):
+        found = corners is not None
+        np.savez(self._path(key), found=found, corners=corners if found else np.zeros(0), size=np.array(size))
+
+
+# Function to get the corners of every image, from the cache or found in parallel.
+# Returns {path: (corners or None, size)} and how many images had to be processed.
+def detect_all(paths, cache=None, workers=None, fast=FAST_DETECTION):
+    cache = cache or CornerCache()
+    results = {}
+    # Both modes find slightly different corners, they are cached separately
+    keys = {path: image_hash(path) + ("-fast" if fast else "") for path in paths}
+    missing = []
+    for path in paths:
+        cached = cache.get(keys[path])
+        if cached is None:
+            missing.append(path)
+        else:
+            results[path] = cached
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, (corners, size) in zip(missing, pool.map(functools.partial(find_corners, fast=fast), missing)):
+                cache.put(keys[path], corners, size)
+                results[path] = (corners, size)
+    return results, len(missing)
+
+
+class IncrementalCalibration:
+    def __init__(self, cache=None, workers=None, fast=FAST_DETECTION):
+        self.cache = cache or CornerCache()
+        self.workers = workers
+        self.fast = fast
+        self.paths = []  # Images used so far
+        self.objpoints = []  # 3D points in the real world
+        self.imgpoints = []  # 2D points in the image plane
+        self.size = None
+        self.camera_matrix = None
+        self.dist_coeffs = None
+        self.error = None  # RMS reprojection error in pixels
+
+    # Function to add images and recalibrate, returns the RMS reprojection error
+    def add_images(self, paths):
+        paths = [path for path in paths if path not in self.paths]
+        results, processed = detect_all(paths, self.cache, self.workers, self.fast)
+        for path in paths:
+            corners, size = results[path]
+            self.paths.append(path)
+            if corners is not None:
+                self.objpoints.append(objp)
+                self.imgpoints.append(corners)
+                self.size = size
+        print(f"{len(paths)} new images ({processed} processed, {len(paths) - processed} cached), "
+              f"checkerboard found in {len(self.imgpoints)} of {len(self.paths)}")
+        return self.calibrate()
+
+    def calibrate(self):
+        if len(self.imgpoints) < 3:
+            print("Not enough images with the checkerboard to calibrate yet")
+            return None
+
+        # Start from the last result, it is usually close already
+        flags = 0
+        if self.camera_matrix is not None:
+            flags = cv2.CALIB_USE_INTRINSIC_GUESS
+        self.error, self.camera_matrix, self.dist_coeffs, _, _ = cv2.calibrateCamera(
+            self.objpoints, self.imgpoints, self.size, self.camera_matrix, self.dist_coeffs, flags=flags)
+        print(f"Reprojection error with {len(self.imgpoints)} images: {self.error:.4f} px")
+        return self.error
+
+
+def list_images(directory):
+    return sorted((os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(".jpg")),
+                  key=lambda path: (len(path), path))
+
+
+# Function to compare both detection modes on a directory: time per image (no cache, one process)
+# and the reprojection error of the calibration they give. The fast mode has to find every board
+# the full resolution search finds.
+def benchmark(directory):
+    images = list_images(directory)
+    found = {}
+    for fast in (False, True):
+        start = time.perf_counter()
+        results = [find_corners(path, fast) for path in images]
+        per_image = (time.perf_counter() - start) / len(images)
+        imgpoints = [corners for corners, _ in results if corners is not None]
+        found[fast] = len(imgpoints)
+        error = cv2.calibrateCamera([objp] * len(imgpoints), imgpoints, results[0][1], None, None)[0]
+        name = "Checked + downscaled" if fast else "Full resolution"
+        print(f"{name:24s} {per_image * 1000:6.1f} ms per image, board in {len(imgpoints)}/{len(images)}, "
+              f"reprojection error {error:.4f} px")
+    assert found[True] >= found[False], f"the fast mode lost {found[False] - found[True]} boards"
+
+    # Images without a board: the same pictures with every square washed out (1/32 size and back)
+    blank = []
+    for path in images[:5]:
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        tiny = cv2.resize(gray, None, fx=1 / 32, fy=1 / 32, interpolation=cv2.INTER_AREA)
+        blank.append(cv2.resize(tiny, gray.shape[::-1], interpolation=cv2.INTER_LINEAR))
+    for fast in (False, True):
+        start = time.perf_counter()
+        assert all(find_board(gray, fast) is None for gray in blank), "a board found in a blank image"
+        name = "Checked + downscaled" if fast else "Full resolution"
+        print(f"{name:24s} {(time.perf_counter() - start) / len(blank) * 1000:6.1f} ms per image without a board")
+
+
+if __name__ == "__main__":
+    # Calibrate offline from calibration_images/ (or another directory), adding the images in batches.
+    # --benchmark compares the full resolution and the downscaled detection instead.
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith("--")]
+    directory = arguments[0] if arguments else "calibration_images"
+    if "--benchmark" in sys.argv:
+        benchmark(directory)
+        sys.exit()
+
+    images = list_images(directory)
+    calibration = IncrementalCalibration()
+    start = time.perf_counter()
+    for batch in range(0, len(images), 5):
+        calibration.add_images(images[batch:batch + 5])
+    print(f"Done in {time.perf_counter() - start:.2f} s")
+    print("Camera matrix:")
+    print(calibration.camera_matrix)
+    print("\nDistortion coefficients:")
+    print(calibration.dist_coeffs)
@@ -1,59 +1,187 @@
-import cv2
+import sys
 import cv2.aruco as aruco
 import numpy as np
-from picamera2 import Picamera2
+from capture import CaptureThread
+from marker_tracker import MarkerTracker
+from luma import GrayConverter
+from pose_filter import MedianPoseFilter
+import calibration_artifact
+import hardware
+import tracing
 
-camera_matrix = np.loadtxt("/home/nischalkharel2002/Desktop/robotic_arm_code/camera_matrix.dat")
-dist_coeffs = np.loadtxt("/home/nischalkharel2002/Desktop/robotic_arm_code/dist_coeffs.dat")
-
-
-# Initialize Picamera2
-picam2 = Picamera2()
-# Set the resolution (lower resolution to reduce memory usage if needed)
-config = picam2.create_preview_configuration(main={"size": (1920, 1080)})
-picam2.configure(config)
-picam2.start()
+# Intrinsics and undistortion maps, loaded once (set ROBOTIC_ARM_CALIBRATION to use another file)
+calibration = calibration_artifact.load_or_build()
 
 # ArUco marker dictionary
 aruco_dict = aruco.Dictionary_get(aruco.DICT_4X4_50)
 parameters = aruco.DetectorParameters_create()
 
-# Function to continuously try to find the ArUco marker and return coordinates
-def get_marker_coordinates():
-    while True:
-        # Capture frame from the camera
-        frame = picam2.capture_array()
+# Searches around the last known marker position first instead of the full frame every time
+tracker = MarkerTracker(aruco_dict, parameters)
 
-        # Ensure the frame is valid (not empty)
-        if frame is None or frame.size == 0:
-            continue
+# Takes the luminance out of each frame without allocating new full-size frames, start_capture()
+# tells it the format of the frames
+to_gray = GrayConverter()
+
+# Background capture thread, started on first use, and the number of the last frame we looked at
+capture = None
+frame_number = 0
+
+# Function to start reading frames in the background, any source with capture_array() can be used
+# in place of the camera (see capture.SyntheticSource and capture.RecordedSource). Its frames are gray
+# or RGB, or YUV420 if format="YUV420" is given.
+def start_capture(source=None, format=None):
+    global capture
+    if capture is None:
+        if source is None:
+            # YUV420 so the gray frame for detection is the Y plane as it is, no color conversion needed
+            source, format = hardware.get_camera("YUV420"), "YUV420"
+        to_gray.format = format
+        capture = CaptureThread(source).start()
+    return capture
 
-        # Convert frame to BGR format (Picamera2 outputs RGB by default)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+def stop_capture():
+    global capture, frame_number
+    if capture is not None:
+        capture.stop()
+        capture = None
+        frame_number = 0
 
-        # Convert frame to grayscale for ArUco detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+# Marker size in meters (3.2 cm)
+MARKER_SIZE = 0.0235
+INCHES_PER_METER = 39.3701
+# Offsets (in inches) from the camera to the arm, added to every marker position
+MARKER_OFFSET = np.array([1.87, -1, 0])
 
-        # Detect ArUco markers in the frame
-        corners, ids, _ = aruco.detectMarkers(gray, aruco_dict, parameters=parameters)
+# Function to turn the detected corners of any number of markers into (x, y, z) positions in inches,
+# with one pose estimation call for all of them. Returns the marker IDs and an (N, 3) array.
+def marker_positions(corners, ids):
+    with tracing.span("pose"):
+        # Move the corners to the undistorted frame, the pose then needs no distortion model
+        corners = [calibration.rectify_points(c) for c in corners]
+
+        # Estimate the pose of all markers at once
+        rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(corners, MARKER_SIZE, calibration.new_camera_matrix, calibration.no_distortion)
+
+    # Get translation vectors (tvec) for distance calculation and convert to inches
+    positions = np.asarray(tvecs).reshape(-1, 3) * INCHES_PER_METER + MARKER_OFFSET
+    return np.asarray(ids).ravel(), positions
+
+# Function to keep capturing until at least one marker is seen, returns (ids, positions) like marker_positions().
+# With max_frames it gives up after that many frames and returns no markers.
+def detect_markers(max_frames=None):
+    global frame_number
+    frames = 0
+    while max_frames is None or frames < max_frames:
+        frames += 1
+        # Always work on the newest frame, the capture thread keeps reading while we detect
+        frame_number, frame = start_capture().get_latest(frame_number)
+
+        with tracing.span("detect"):
+            # Grayscale frame for ArUco detection (Y plane of the YUV frame, RGB sources get converted)
+            gray = to_gray(frame)
+
+            # Detect ArUco markers in the frame
+            corners, ids = tracker.detect(gray)
         print("trying to detect the block")
         if ids is not None:
-            # Estimate the pose of the marker
-            rvecs, tvecs, _ = aruco.estimatePoseSingleMarkers(corners, 0.0235, camera_matrix, dist_coeffs)  # Marker size in meters (3.2 cm)
-            for i in range(len(ids)):
-                # Get translation vector (tvec) for distance calculation and convert to inches
-                x_m, y_m, z_m = tvecs[i][0]  # (x, y, z) in meters
-                x_in, y_in, z_in = x_m * 39.3701, y_m * 39.3701, z_m * 39.3701  # Convert to inches
-                x_in += 1.87
-                y_in -= 1
-                return x_in, y_in, z_in
+            return marker_positions(corners, ids)
+    return np.zeros(0, dtype=int), np.zeros((0, 3))
+
+# Function to continuously try to find the ArUco marker and return coordinates
+def get_marker_coordinates():
+    ids, positions = detect_markers()
+    x_in, y_in, z_in = positions[0]
+    return float(x_in), float(y_in), float(z_in)
+
+# Function to follow the first marker over several frames and return its position as soon as the
+# filtered estimate is stable (or after max_frames, whichever comes first)
+def get_stable_marker_coordinates(max_frames=30):
+    pose_filter = MedianPoseFilter()
+    marker = None
+    for frame in range(1, max_frames + 1):
+        ids, positions = detect_markers()
+        if marker is None:
+            marker = ids[0]
+        if marker not in ids:
+            continue
+        pose_filter.update(positions[list(ids).index(marker)])
+        if pose_filter.converged():
+            break
+    print(f"Marker position settled after {frame} frames")
+    x_in, y_in, z_in = pose_filter.estimate
+    return float(x_in), float(y_in), float(z_in)
+
+# Function to follow one block like get_stable_marker_coordinates(), but not any of the markers in
+# exclude (blocks already picked). Returns (marker id, (x, y, z)), None if no other block is in view.
+def get_stable_marker(exclude=(), max_frames=30):
+    pose_filter = MedianPoseFilter()
+    marker = None
+    for frame in range(1, max_frames + 1):
+        ids, positions = detect_markers(max_frames=1)
+        if marker is None:
+            candidates = [marker_id for marker_id in ids if marker_id not in exclude]
+            if not candidates:
+                # The tracker may be stuck on a picked block, search the whole frame again
+                tracker.reset()
+                continue
+            marker = candidates[0]
+        if marker not in ids:
+            continue
+        pose_filter.update(positions[list(ids).index(marker)])
+        if pose_filter.converged():
+            break
+    if pose_filter.estimate is None:
+        return None
+    print(f"Marker {marker} settled after {frame} frames")
+    x_in, y_in, z_in = pose_filter.estimate
+    return int(marker), (float(x_in), float(y_in), float(z_in))
+
+# Function to find every marker in one frame, returns {marker id: (x, y, z)} in inches
+def get_all_marker_coordinates():
+    # The tracker would only look around the markers it already knows, start with a full search
+    tracker.reset()
+    ids, positions = detect_markers()
+    return {int(marker_id): tuple(float(v) for v in position) for marker_id, position in zip(ids, positions)}
 
 # Function to be used externally to get the coordinates
+# Function to check the batched pose path on a synthetic frame with count markers (no camera needed):
+# every marker has to be found in one call, and the (N, 3) positions from one marker_positions() call
+# have to match the ones from estimating each marker on its own
+def check_synthetic(count=5):
+    from capture import SyntheticSource
+    from marker_tracker import draw_marker
+
+    frame = np.full((1080, 1920), 90, dtype=np.uint8)
+    for marker_id in range(count):
+        draw_marker(frame, aruco_dict, marker_id, 150 + 340 * marker_id, 200 + 120 * marker_id, 120)
+
+    start_capture(SyntheticSource([frame]))
+    try:
+        found = get_all_marker_coordinates()
+    finally:
+        stop_capture()
+    assert sorted(found) == list(range(count)), f"found markers {sorted(found)} of {count}"
+
+    corners, ids, _ = aruco.detectMarkers(frame, aruco_dict, parameters=parameters)
+    ids, positions = marker_positions(corners, ids)
+    assert positions.shape == (count, 3), f"positions have shape {positions.shape}"
+    for marker_id, corner, position in zip(ids, corners, positions):
+        _, single = marker_positions([corner], [marker_id])
+        assert np.allclose(single[0], position), f"marker {marker_id}: {single[0]} alone, {position} batched"
+        assert np.allclose(found[int(marker_id)], position), f"marker {marker_id}: {found[int(marker_id)]} from the capture"
+    print(f"All {count} markers found, batched poses match the single ones")
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--synthetic":
+        check_synthetic(int(sys.argv[2]) if len(sys.argv) > 2 else 5)
+        sys.exit()
+
     try:
         x, y, z = get_marker_coordinates()
         
         print(f"X: {x:.2f} in, Y: {y:.2f} in, Z: {z:.2f} in")
     finally:
         # Release resources
-        picam2.stop()
+        stop_capture()
+        hardware.close()
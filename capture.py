@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+import cv2
+import numpy as np
+import tracing
+
+# Background frame capture so sensor readout overlaps with marker detection.
+#
+# A source is anything with a capture_array() method returning an RGB frame, like a Picamera2.
+# The capture thread copies every frame into a small preallocated ring buffer and the detector
+# always takes the newest one, older frames it never got to are dropped.
+
+
+# Source that cycles through a list of frames, for running the pipeline without a camera
+class SyntheticSource:
+    def __init__(self, frames, frame_time=0.0):
+        self.frames = [np.ascontiguousarray(frame) for frame in frames]
+        self.frame_time = frame_time  # Simulated readout time per frame in seconds
+        self.index = 0
+
+    def capture_array(self):
+        if self.frame_time:
+            time.sleep(self.frame_time)
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        return frame
+
+
+# Source that replays recorded images from a directory (e.g. calibration_images/)
+class RecordedSource(SyntheticSource):
+    def __init__(self, directory, frame_time=0.0):
+        names = sorted(f for f in os.listdir(directory) if f.endswith((".jpg", ".png")))
+        # cv2 loads BGR, flip to RGB so the frames look like the ones from Picamera2
+        frames = [cv2.cvtColor(cv2.imread(os.path.join(directory, name)), cv2.COLOR_BGR2RGB) for name in names]
+        super().__init__(frames, frame_time)
+
+
+# Fixed-size ring of preallocated frames with one writer (the capture thread) and one reader
+class FrameRing:
+    def __init__(self, shape, dtype, slots=3):
+        self.frames = np.empty((slots,) + tuple(shape), dtype=dtype)
+        self.condition = threading.Condition()
+        self.latest = -1  # Slot holding the newest frame
+        self.reading = -1  # Slot the reader is working on, never overwritten
+        self.latest_read = True
+        self.count = 0  # Number of frames written so far
+        self.dropped = 0  # Frames that were replaced before anyone read them
+
+    def put(self, frame):
+        with self.condition:
+            slot = next(i for i in range(len(self.frames)) if i != self.latest and i != self.reading)
+
+        # The reader only ever takes the latest slot, so this one can be filled without the lock
+        np.copyto(self.frames[slot], frame)
+
+        with self.condition:
+            if not self.latest_read:
+                self.dropped += 1
+            self.latest = slot
+            self.latest_read = False
+            self.count += 1
+            self.condition.notify_all()
+
+    # Returns (frame number, frame) for the newest frame after frame number `after`, or (after, None)
+    # on timeout. The frame stays valid until the next call.
+    def get_latest(self, after=0, timeout=None):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.count > after, timeout):
+                return after, None
+            self.reading = self.latest
+            self.latest_read = True
+            return self.count, self.frames[self.reading]
+
+
+# Thread that keeps reading frames from a source into a FrameRing
+class CaptureThread:
+    def __init__(self, source, slots=3):
+        self.source = source
+        self.slots = slots
+        self.ring = None
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()  # The ring is allocated from the first frame
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def get_latest(self, after=0, timeout=None):
+        return self.ring.get_latest(after, timeout)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            with tracing.span("capture"):
+                frame = self.source.capture_array()
+
+            # Ensure the frame is valid (not empty)
+            if frame is None or frame.size == 0:
+                continue
+
+            if self.ring is None:
+                self.ring = FrameRing(frame.shape, frame.dtype, self.slots)
+                self.ready.set()
+            self.ring.put(frame)
+
+
+if __name__ == "__main__":
+    # Compare capture-then-detect in series with the capture thread, using a fake camera with a
+    # 30 ms readout and a fake 30 ms detector
+    frames = [np.full((1080, 1920, 3), i, dtype=np.uint8) for i in range(4)]
+
+    def detect(frame):
+        time.sleep(0.03)
+
+    source = SyntheticSource(frames, frame_time=0.03)
+    start = time.perf_counter()
+    for _ in range(30):
+        detect(source.capture_array())
+    serial = (time.perf_counter() - start) / 30
+
+    pipeline = CaptureThread(SyntheticSource(frames, frame_time=0.03)).start()
+    number = 0
+    start = time.perf_counter()
+    for _ in range(30):
+        number, frame = pipeline.get_latest(number)
+        detect(frame)
+    threaded = (time.perf_counter() - start) / 30
+    pipeline.stop()
+
+    print(f"In series:      {serial * 1000:.1f} ms per detection")
+    print(f"Capture thread: {threaded * 1000:.1f} ms per detection ({pipeline.ring.dropped} stale frames dropped)")
@@ -0,0 +1,40 @@
+import time
+
+# Clocks for everything that waits on the arm. The system clock really waits, the virtual one only
+# moves its time forward, so motion can be simulated much faster than real time.
+
+
+class SystemClock:
+    def now(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+# Real time running faster by factor: everything still happens at the same time relative to each
+# other, the waits are just shorter (work that is not waiting counts factor times longer)
+class ScaledClock:
+    def __init__(self, factor):
+        self.factor = factor
+        self.origin = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self.origin) * self.factor
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.factor)
+
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.time = start
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.time += seconds
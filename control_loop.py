@@ -0,0 +1,130 @@
+import math
+from collections import deque
+from clock import SystemClock
+
+# Fixed-rate loop for servo writes. Every tick has a deadline on the monotonic clock (start + n * period)
+# instead of a sleep after the work, so the rate does not drift with how long the work takes. The loop
+# keeps statistics of how well it keeps time: wake-up jitter, missed deadlines, how long the write
+# to each channel takes and how long sending buffered writes to the bus takes.
+
+RATE_HZ = 50
+LOG_INTERVAL = 5.0  # Seconds between log lines, None to never log
+
+
+class LoopStats:
+    def __init__(self, samples=500):
+        self.ticks = 0
+        self.misses = 0
+        self.jitter = deque(maxlen=samples)  # Seconds between the deadline and waking up, last few ticks
+        self.write_time = {}  # channel: [writes, total seconds, max seconds]
+        self.flush_time = [0, 0.0, 0.0]  # Buffered writes sent to the bus: [flushes, total seconds, max seconds]
+
+    def add_write(self, channel, seconds):
+        stats = self.write_time.setdefault(channel, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def add_flush(self, seconds):
+        self.flush_time[0] += 1
+        self.flush_time[1] += seconds
+        self.flush_time[2] = max(self.flush_time[2], seconds)
+
+    def summary(self):
+        jitter = sorted(self.jitter)
+        flushes, flush_total, flush_max = self.flush_time
+        return {
+            "ticks": self.ticks,
+            "misses": self.misses,
+            "jitter_p50": jitter[len(jitter) // 2] if jitter else 0.0,
+            "jitter_max": jitter[-1] if jitter else 0.0,
+            "write_mean": {channel: total / count for channel, (count, total, _) in self.write_time.items()},
+            "write_max": {channel: worst for channel, (_, _, worst) in self.write_time.items()},
+            "flushes": flushes,
+            "bus_mean": flush_total / flushes if flushes else 0.0,
+            "bus_max": flush_max,
+        }
+
+    def log_line(self):
+        s = self.summary()
+        writes = " ".join(f"ch{channel}={mean * 1000:.2f}ms" for channel, mean in sorted(s["write_mean"].items()))
+        line = (f"Control loop: {s['ticks']} ticks, {s['misses']} missed, jitter p50 {s['jitter_p50'] * 1000:.2f} ms "
+                f"max {s['jitter_max'] * 1000:.2f} ms, write {writes}")
+        if s["flushes"]:
+            line += f", bus write {s['bus_mean'] * 1000:.2f} ms per tick max {s['bus_max'] * 1000:.2f} ms"
+        return line
+
+
+class ControlLoop:
+    def __init__(self, kit, rate_hz=RATE_HZ, clock=None, log_interval=LOG_INTERVAL):
+        self.kit = kit  # ServoKit or anything shaped like it (see fake_servokit.FakeServoKit)
+        self.period = 1 / rate_hz
+        self.clock = clock or SystemClock()
+        self.log_interval = log_interval
+        self.stats = LoopStats()
+        self.deadline = None
+        self.last_log = None
+
+    # Function to start timing ticks from now
+    def start(self):
+        self.deadline = self.clock.now() + self.period
+        if self.last_log is None:
+            self.last_log = self.clock.now()
+
+    # Function to write {channel: angle} to the servos, timing every channel and the bus transfer
+    def write(self, angles):
+        for channel, angle in angles.items():
+            start = self.clock.now()
+            self.kit.servo[channel].angle = angle
+            self.stats.add_write(channel, self.clock.now() - start)
+
+        # Output layers that buffer the writes (see servo_output.py) send them once per tick, the I2C
+        # time is spent here and not in the channel writes above
+        flush = getattr(self.kit, "flush", None)
+        if flush is not None:
+            start = self.clock.now()
+            flush()
+            self.stats.add_flush(self.clock.now() - start)
+
+    # Function to wait for the deadline of the next tick
+    def wait(self):
+        if self.deadline is None:
+            self.start()
+        self.stats.ticks += 1
+        now = self.clock.now()
+        if now > self.deadline:
+            # The work took longer than a tick, skip the ticks that are already gone
+            self.stats.misses += 1
+            self.deadline += self.period * math.ceil((now - self.deadline) / self.period)
+
+        self.clock.sleep(self.deadline - now)
+        self.stats.jitter.append(max(0.0, self.clock.now() - self.deadline))
+        self.deadline += self.period
+
+        if self.log_interval is not None and self.clock.now() - self.last_log >= self.log_interval:
+            self.last_log = self.clock.now()
+            print(self.stats.log_line())
+
+    # Function to call step(tick) once per tick until it returns False (or for a number of ticks)
+    def run(self, step, ticks=None):
+        self.start()
+        tick = 0
+        while ticks is None or tick < ticks:
+            if step(tick) is False:
+                break
+            self.wait()
+            tick += 1
+
+
+if __name__ == "__main__":
+    # Run the loop at 50 Hz for two seconds against a fake ServoKit whose writes take 1-3 ms
+    import random
+    import time
+    from fake_servokit import FakeServoKit
+
+    kit = FakeServoKit(write_latency=lambda: random.uniform(0.001, 0.003))
+    loop = ControlLoop(kit, log_interval=1.0)
+    start = time.monotonic()
+    loop.run(lambda tick: loop.write({channel: 90 for channel in range(5)}), ticks=100)
+    print(f"100 ticks in {time.monotonic() - start:.2f} s")
+    print(loop.stats.log_line())
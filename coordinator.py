@@ -0,0 +1,207 @@
+import asyncio
+import time
+import tracing
+
+# Runs voice, vision and motion of the arm as separate asyncio tasks instead of one after the other.
+#
+# As soon as the activation phrase is heard, the marker search starts while the arm is still saying
+# that it is activating, and the "ready" message is spoken while the arm moves back home.
+# The hardware functions are all blocking, so each of them runs in a worker thread:
+#   listen()                   -> recognized text
+#   speak(text)                -> returns when done speaking
+#   find_target()              -> joint angles for the next block, None if there is none in reach
+#   pick_and_place(*angles)    -> returns when the block is placed
+#   reset()                    -> optional, moves the arm home before and after pick_and_place()
+# Other phrases can run their own blocking function as a whole cycle, see `commands`.
+
+ACTIVATION_PHRASE = "activate now"
+ACTIVATING_MESSAGE = "Please, wait,    The arm, is, activating!"
+READY_MESSAGE = "I  am, ready, to, go, again!"
+
+
+class Coordinator:
+    def __init__(self, listen, speak, find_target, pick_and_place, reset=None, commands=None, clock=time.monotonic):
+        self.listen = listen
+        self.speak = speak
+        self.find_target = find_target
+        self.pick_and_place = pick_and_place
+        self.reset = reset
+        self.commands = commands or {}  # {phrase: function}
+        self.clock = clock
+        self.timings = []  # One dict per cycle, seconds since the activation phrase was heard
+        self.failure = None  # Exception that ended a background task, raised again by run()
+
+    async def run(self, cycles=None):
+        self.activations = asyncio.Queue()
+        self.speech = asyncio.Queue()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+        # If listening or speaking fails, nothing would ever come out of the queues again and run()
+        # would wait forever: stop it and raise the error instead
+        main = asyncio.current_task()
+
+        def stopped(task):
+            if not task.cancelled() and task.exception() is not None:
+                self.failure = task.exception()
+                main.cancel()
+
+        tasks = [asyncio.create_task(self._audio_input()), asyncio.create_task(self._speech_output())]
+        for task in tasks:
+            task.add_done_callback(stopped)
+        try:
+            done = 0
+            while cycles is None or done < cycles:
+                heard_at, command = await self.activations.get()
+                if command is None:
+                    await self._cycle(heard_at)
+                else:
+                    await self._command(heard_at, command)
+                done += 1
+        except asyncio.CancelledError:
+            if self.failure is not None:
+                raise self.failure from None
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Task that listens for the activation phrase, not while a cycle runs (it would hear the arm talk)
+    async def _audio_input(self):
+        while True:
+            await self.idle.wait()
+            with tracing.span("listen"):
+                text = await asyncio.to_thread(self.listen)
+            if text == ACTIVATION_PHRASE or text in self.commands:
+                self.idle.clear()
+                self.activations.put_nowait((self.clock(), self.commands.get(text)))
+
+    # Task that speaks queued messages one after the other
+    async def _speech_output(self):
+        while True:
+            text = await self.speech.get()
+            try:
+                with tracing.span("speak", {"text": text}):
+                    await asyncio.to_thread(self.speak, text)
+            except Exception as error:
+                # One message that could not be said must not stop the ones after it
+                print(f"Could not speak '{text}': {error}")
+            finally:
+                self.speech.task_done()
+
+    async def _cycle(self, heard_at):
+        timing = {}
+        self.speech.put_nowait(ACTIVATING_MESSAGE)
+
+        # Marker search and the move home run while the arm is still talking
+        search = asyncio.create_task(asyncio.to_thread(self.find_target))
+        if self.reset is not None:
+            await asyncio.to_thread(self.reset)
+        angles = await search
+        timing["target"] = self.clock() - heard_at
+
+        if angles:
+            timing["motion_start"] = self.clock() - heard_at
+            await asyncio.to_thread(self.pick_and_place, *angles)
+        else:
+            print("Error: Could not find valid angles for the given target.")
+        timing["done"] = self.clock() - heard_at
+
+        # Listen again once the arm is home and stopped talking, so it does not hear itself
+        self.speech.put_nowait(READY_MESSAGE)
+        if self.reset is not None:
+            await asyncio.to_thread(self.reset)
+        await self._finish(heard_at, timing)
+
+    async def _command(self, heard_at, command):
+        self.speech.put_nowait(ACTIVATING_MESSAGE)
+        await asyncio.to_thread(command)
+        timing = {"done": self.clock() - heard_at}
+        self.speech.put_nowait(READY_MESSAGE)
+        await self._finish(heard_at, timing)
+
+    async def _finish(self, heard_at, timing):
+        await self.speech.join()
+        timing["ready"] = self.clock() - heard_at
+        self.timings.append(timing)
+        self.idle.set()
+
+
+# Fakes for every piece of hardware, each just takes as long as the real one would
+
+class FakeMicrophone:
+    def __init__(self, phrases, delay=0.0):
+        self.phrases = list(phrases)
+        self.delay = delay
+
+    def __call__(self):
+        time.sleep(self.delay)
+        return self.phrases.pop(0) if self.phrases else ""
+
+
+class FakeSpeaker:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.spoken = []
+
+    def __call__(self, text):
+        time.sleep(self.delay)
+        self.spoken.append(text)
+
+
+class FakeCamera:
+    def __init__(self, angles=(90, 30, 120, 20), delay=0.0):
+        self.angles = angles
+        self.delay = delay
+
+    def __call__(self):
+        time.sleep(self.delay)
+        return self.angles
+
+
+class FakeArm:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.moves = 0
+
+    def __call__(self, *angles):
+        time.sleep(self.delay)
+        self.moves += 1
+
+
+if __name__ == "__main__":
+    # End-to-end latency with fakes: 2 s to speak each message, 1 s to find the block, 0.5 s to move
+    # home and 3 s to pick and place. In series one cycle took all of it added up.
+    coordinator = Coordinator(FakeMicrophone(["hello", ACTIVATION_PHRASE], delay=0.01),
+                              FakeSpeaker(delay=2.0), FakeCamera(delay=1.0), FakeArm(delay=3.0),
+                              reset=FakeArm(delay=0.5))
+    asyncio.run(coordinator.run(cycles=1))
+    timing = coordinator.timings[0]
+    print(f"In series:   ready to listen again {2.0 + 0.5 + 1.0 + 3.0 + 0.5 + 2.0:.2f} s after the activation")
+    print(f"Coordinator: target after {timing['target']:.2f} s, moving after {timing['motion_start']:.2f} s, "
+          f"done after {timing['done']:.2f} s, ready to listen after {timing['ready']:.2f} s")
+
+    # A failing speaker only loses its message, a failing microphone ends run() with its error
+    class BrokenSpeaker(FakeSpeaker):
+        def __call__(self, text):
+            if not self.spoken:
+                self.spoken.append(None)
+                raise OSError("no audio device")
+            super().__call__(text)
+
+    def broken_microphone():
+        raise OSError("no microphone")
+
+    speaker = BrokenSpeaker()
+    coordinator = Coordinator(FakeMicrophone([ACTIVATION_PHRASE, ACTIVATION_PHRASE]), speaker, FakeCamera(), FakeArm())
+    asyncio.run(asyncio.wait_for(coordinator.run(cycles=2), timeout=5))
+    assert speaker.spoken == [None, READY_MESSAGE, ACTIVATING_MESSAGE, READY_MESSAGE], speaker.spoken
+
+    coordinator = Coordinator(broken_microphone, FakeSpeaker(), FakeCamera(), FakeArm())
+    try:
+        asyncio.run(asyncio.wait_for(coordinator.run(cycles=1), timeout=5))
+    except OSError as error:
+        print(f"Failed speech was skipped, a failed microphone stopped run() with: {error}")
+    else:
+        raise AssertionError("run() did not raise the microphone error")
@@ -0,0 +1,34 @@
+from clock import SystemClock
+
+# Stand-in for adafruit_servokit.ServoKit that records every angle written to it with a timestamp,
+# for running the motion code without the arm.
+
+
+class FakeServo:
+    def __init__(self, kit, channel):
+        self.kit = kit
+        self.channel = channel
+        self._angle = None
+
+    @property
+    def angle(self):
+        return self._angle
+
+    @angle.setter
+    def angle(self, value):
+        if self.kit.write_latency:
+            self.kit.clock.sleep(self.kit.write_latency())  # Time the I2C write would take
+        self._angle = value
+        self.kit.writes.append((self.kit.clock.now(), self.channel, value))
+
+
+class FakeServoKit:
+    def __init__(self, channels=16, clock=None, write_latency=None):
+        self.clock = clock or SystemClock()
+        self.write_latency = write_latency  # Function returning how long a write takes, in seconds
+        self.servo = [FakeServo(self, channel) for channel in range(channels)]
+        self.writes = []  # (time, channel, angle) for every write
+
+    # Time of the last write to each channel
+    def last_write_times(self):
+        return {channel: t for t, channel, _ in self.writes}
@@ -0,0 +1,253 @@
+import os
+import time
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+from clock import SystemClock, VirtualClock
+from fake_servokit import FakeServo, FakeServoKit
+
+# One place where the servos, the camera, the microphone, the speaker and the clock come from.
+#
+# Nothing is opened at import time, every device is created the first time something asks for it and
+# then shared, so importing move_motor or camera no longer needs the arm. There are two backends:
+#   real  the PCA9685 over I2C, the Picamera2, the USB microphone and espeak
+#   sim   servos with a speed limit, a camera that renders ArUco markers at given poses, scripted
+#         speech, all on one clock (a VirtualClock runs the arm much faster than real time)
+# Set ROBOTIC_ARM_BACKEND=sim, or call use_simulator() before anything asks for a device.
+
+BACKEND = os.environ.get("ROBOTIC_ARM_BACKEND", "real")
+
+CAPTURE_SIZE = (1920, 1080)
+SERVO_SPEED = 300  # Degrees per second a simulated joint can turn, about an MG996R without load
+
+_devices = {}
+
+
+# Function to switch to the simulator. Any device passed in is used instead of the default one.
+def use_simulator(clock=None, servos=None, camera=None, microphone=None, speaker=None):
+    global BACKEND
+    close()
+    BACKEND = "sim"
+    given = {"clock": clock, "servos": servos, "camera": camera, "microphone": microphone, "speaker": speaker}
+    _devices.update({name: device for name, device in given.items() if device is not None})
+
+
+def _get(name, real, sim):
+    if name not in _devices:
+        _devices[name] = sim() if BACKEND == "sim" else real()
+    return _devices[name]
+
+
+def get_clock():
+    return _get("clock", SystemClock, SystemClock)
+
+
+def get_servos():
+    def real():
+        from servo_output import open_servo_output
+        return open_servo_output(channels=16)
+
+    return _get("servos", real, lambda: SimServoKit(clock=get_clock()))
+
+
+# Function to get the started camera. format=None is the camera's default RGB preview format
+# (for showing and saving pictures), the marker detection wants YUV420. The first call decides.
+def get_camera(format="YUV420"):
+    def real():
+        from picamera2 import Picamera2
+
+        picam2 = Picamera2()
+        main = {"size": CAPTURE_SIZE, "format": format} if format else {"size": CAPTURE_SIZE}
+        picam2.configure(picam2.create_preview_configuration(main=main))
+        picam2.start()
+        return picam2
+
+    def sim():
+        import calibration_artifact
+        return SimCamera(calibration_artifact.load_or_build(), yuv=format == "YUV420")
+
+    return _get("camera", real, sim)
+
+
+# Function returning the function that listens for one command and returns the text
+def get_microphone():
+    def real():
+        import audio_in
+        return audio_in.listen_locally if audio_in.OFFLINE else audio_in.listen_to_microphone
+
+    return _get("microphone", real, lambda: SimMicrophone([], clock=get_clock()))
+
+
+# Function returning the function that says a message and returns once it has been said
+def get_speaker():
+    def real():
+        from audio_out import speak_text
+        return speak_text
+
+    return _get("speaker", real, lambda: SimSpeaker(clock=get_clock()))
+
+
+# Function to stop the camera and forget every device, the next request opens them again
+def close():
+    camera = _devices.get("camera")
+    if camera is not None and hasattr(camera, "stop"):
+        camera.stop()
+    _devices.clear()
+
+
+# Simulated servos: angles are recorded like on the FakeServoKit, and every joint turns towards its
+# last command at no more than max_speed, so the real position lags behind commands that are too fast
+
+class SimServo(FakeServo):
+    @FakeServo.angle.setter
+    def angle(self, value):
+        self.kit.command(self.channel, value)
+        FakeServo.angle.fset(self, value)
+
+
+class SimServoKit(FakeServoKit):
+    def __init__(self, channels=16, clock=None, max_speed=SERVO_SPEED):
+        super().__init__(channels, clock)
+        self.max_speed = max_speed  # Degrees per second, the same for every joint or {channel: speed}
+        self.speeds = [max_speed.get(channel, SERVO_SPEED) if isinstance(max_speed, dict) else max_speed
+                       for channel in range(channels)]
+        self.servo = [SimServo(self, channel) for channel in range(channels)]
+        self.targets = [None] * channels
+        self.positions = [None] * channels
+        self.updated = [0.0] * channels
+        self.max_lag = 0.0  # Largest distance in degrees between a joint and its command when it got a new one
+
+    # Function returning where the joint really is right now
+    def position(self, channel):
+        now = self.clock.now()
+        target = self.targets[channel]
+        if target is not None and self.positions[channel] is not None:
+            step = self.speeds[channel] * (now - self.updated[channel])
+            position = self.positions[channel]
+            self.positions[channel] = min(target, position + step) if target > position else max(target, position - step)
+        self.updated[channel] = now
+        return self.positions[channel]
+
+    def command(self, channel, angle):
+        position = self.position(channel)
+        if position is None or angle is None:
+            self.positions[channel] = angle  # First command, or limp: the joint is where it was told
+        else:
+            self.max_lag = max(self.max_lag, abs(self.targets[channel] - position))
+        self.targets[channel] = angle
+
+    # Writes take effect at once, there is nothing buffered to send (same interface as ServoOutput)
+    def flush(self):
+        return 0
+
+    # Function returning how long until every joint has reached its command
+    def time_to_settle(self):
+        return max((abs(target - self.position(channel)) / self.speeds[channel]
+                    for channel, target in enumerate(self.targets) if target is not None), default=0.0)
+
+
+# Simulated camera: draws every placed marker where the calibrated camera would see it, on a plain
+# background. Frames are YUV420 like the camera.py configuration, or RGB.
+class SimCamera:
+    def __init__(self, calibration, dictionary=None, marker_size=0.0235, yuv=True, background=170, fps=30):
+        self.calibration = calibration
+        self.dictionary = dictionary or aruco.Dictionary_get(aruco.DICT_4X4_50)
+        self.marker_size = marker_size  # Meters, same as camera.MARKER_SIZE
+        self.yuv = yuv
+        self.background = background
+        self.frame_time = 1 / fps if fps else 0.0  # Real seconds between frames, like the sensor readout
+        self.markers = {}  # {marker id: (rvec, tvec)}
+        self.frame = None
+        self.frames = 0
+
+    # Function to put a marker at a pose in the camera frame (meters). The default rotation faces the
+    # camera the right way up, like a block lying in front of it.
+    def place(self, marker_id, tvec, rvec=(np.pi, 0, 0)):
+        self.markers[marker_id] = (np.array(rvec, dtype=np.float64), np.array(tvec, dtype=np.float64))
+        self.frame = None
+
+    def remove(self, marker_id):
+        self.markers.pop(marker_id, None)
+        self.frame = None
+
+    def _render(self):
+        width, height = self.calibration.size
+        gray = np.full((height, width), self.background, dtype=np.uint8)
+        for marker_id, (rvec, tvec) in self.markers.items():
+            # Marker with a white border of one bit around it, the detector needs the contrast
+            bits = self.dictionary.markerSize + 2
+            side = 20 * bits
+            image = cv2.copyMakeBorder(aruco.drawMarker(self.dictionary, marker_id, side), 20, 20, 20, 20,
+                                       cv2.BORDER_CONSTANT, value=255)
+            half = self.marker_size / 2 * (bits + 2) / bits
+            corners = np.array([[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]])
+            projected, _ = cv2.projectPoints(corners, rvec, tvec, self.calibration.camera_matrix,
+                                             self.calibration.dist_coeffs)
+            source = np.float32([[0, 0], [side + 40, 0], [side + 40, side + 40], [0, side + 40]])
+            homography = cv2.getPerspectiveTransform(source, projected.reshape(4, 2).astype(np.float32))
+            cv2.warpPerspective(image, homography, (width, height), dst=gray, borderMode=cv2.BORDER_TRANSPARENT)
+
+        if not self.yuv:
+            return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+        frame = np.full((height * 3 // 2, width), 128, dtype=np.uint8)  # No color in the U and V planes
+        frame[:height] = gray
+        return frame
+
+    def capture_array(self):
+        if self.frame_time:
+            time.sleep(self.frame_time)
+        if self.frame is None:
+            self.frame = self._render()
+        self.frames += 1
+        return self.frame
+
+    def stop(self):
+        pass
+
+
+# Simulated microphone, hears the given phrases one after the other, then nothing
+class SimMicrophone:
+    def __init__(self, phrases, clock=None, delay=1.0):
+        self.phrases = list(phrases)
+        self.clock = clock or SystemClock()
+        self.delay = delay  # Seconds of talking per phrase
+
+    def __call__(self):
+        self.clock.sleep(self.delay)
+        return self.phrases.pop(0) if self.phrases else ""
+
+
+# Simulated speaker, takes as long as espeak would to say the message
+class SimSpeaker:
+    def __init__(self, clock=None, words_per_second=2.5):
+        self.clock = clock or SystemClock()
+        self.words_per_second = words_per_second
+        self.spoken = []
+
+    def __call__(self, text):
+        self.clock.sleep(len(text.split()) / self.words_per_second)
+        self.spoken.append(text)
+
+
+if __name__ == "__main__":
+    # arm.main() headless: a block in front of the simulated camera, simulated servos on a virtual
+    # clock. Prints how long the cycle takes for the arm and how long it took to simulate.
+    # (arm imports this file as `hardware`, not as __main__, so the devices are set up there)
+    import hardware
+    import arm
+    import camera
+
+    clock = VirtualClock()
+    hardware.use_simulator(clock=clock)
+    hardware.get_camera().place(0, (-0.05, 0.02, 0.25))
+
+    start = time.perf_counter()
+    arm.main()
+    wall = time.perf_counter() - start
+    camera.stop_capture()
+
+    servos = hardware.get_servos()
+    print(f"Pick and place took {clock.now():.2f} s of arm time, simulated in {wall:.2f} s "
+          f"({clock.now() / wall:.0f}x real time)")
+    print(f"{len(servos.writes)} servo writes, joints at most {servos.max_lag:.2f} degrees behind their command, "
+          f"{hardware.get_camera().frames} camera frames")
@@ -0,0 +1,146 @@
+import contextlib
+import io
+import math
+import os
+import time
+import numpy as np
+import calculate_angles_for
+
+# Precomputed inverse kinematics so the arm does not have to run the G_z search for every target.
+#
+# calculate() never uses y (the height is fixed by GRIPPER_LENGTH), the shoulder, elbow and wrist
+# angles only depend on the radius from the base axis, sqrt(x^2 + z^2), and on z, which sets the
+# 1% step of the G_z search. So the table is a grid over the radius and z / radius (1.0 is straight
+# ahead) holding the first valid (shoulder, elbow, wrist) solution of calculate() for every node,
+# NaN where there is none.
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ik_table.npz")
+
+# Grid layout, radius in inches
+R_MIN = 0.0
+R_MAX = 30.0
+R_STEP = 0.05
+DIR_MIN = 0.0
+DIR_MAX = 1.0
+DIR_STEP = 0.02
+
+# Max difference (in degrees) between lookup() and calculate() for shoulder, elbow and wrist.
+# Most of it comes from calculate() itself, its 1% G_z step moves the wrist by up to ~2 degrees
+TOLERANCE = 2.5
+
+_table = None
+
+
+# Function to run calculate() over every node of the grid (done once offline)
+def build_table():
+    radii = R_MIN + R_STEP * np.arange(int(round((R_MAX - R_MIN) / R_STEP)) + 1)
+    directions = DIR_MIN + DIR_STEP * np.arange(int(round((DIR_MAX - DIR_MIN) / DIR_STEP)) + 1)
+
+    # Every node as an (x, y, z) target, solved in one go by the batch solver
+    r, d = np.meshgrid(radii, directions, indexing="ij")
+    z = r * d
+    x = np.sqrt(np.maximum(0.0, r**2 - z**2))
+    solved, _ = calculate_angles_for.calculate_batch(np.column_stack([x.ravel(), np.zeros(x.size), z.ravel()]))
+    angles = solved[:, 1:].reshape(len(radii), len(directions), 3).astype(np.float32)
+
+    return {"angles": angles, "r_min": R_MIN, "r_step": R_STEP, "dir_min": DIR_MIN, "dir_step": DIR_STEP}
+
+
+def save_table(table, path=TABLE_PATH):
+    np.savez_compressed(path, **table)
+
+
+# Function to load the table once, it gets built and saved first if the file does not exist yet
+def load_table(path=TABLE_PATH):
+    global _table
+    if _table is not None:
+        return _table
+
+    if not os.path.exists(path):
+        print(f"IK table not found at {path}, building it (one time only)...")
+        save_table(build_table(), path)
+
+    with np.load(path) as data:
+        _table = {
+            "angles": data["angles"],
+            "r_min": float(data["r_min"]),
+            "r_step": float(data["r_step"]),
+            "dir_min": float(data["dir_min"]),
+            "dir_step": float(data["dir_step"]),
+        }
+    return _table
+
+
+# Function to get the same angles as calculate() in constant time, None if the target is unreachable
+def lookup(x, y, z):
+    table = load_table()
+    angles = table["angles"]
+
+    # Base angle is a single atan2, same as calculate()
+    theta_base_deg = math.degrees(math.atan2(abs(x), abs(z)))
+    if x >= 0:
+        theta_base_deg = calculate_angles_for.BASE_OFFSET - theta_base_deg
+    else:
+        theta_base_deg = calculate_angles_for.BASE_OFFSET + theta_base_deg
+    theta_base_deg = max(calculate_angles_for.BASE_MIN, min(calculate_angles_for.BASE_MAX, theta_base_deg))
+
+    # Position of the target in grid units
+    radius = math.sqrt(x**2 + z**2)
+    if radius == 0:
+        return None  # Target on the base axis
+    fr = (radius - table["r_min"]) / table["r_step"]
+    fz = (z / radius - table["dir_min"]) / table["dir_step"]
+    if fr < 0 or fz < 0 or fr > angles.shape[0] - 1 or fz > angles.shape[1] - 1:
+        return None  # Outside of the grid, nothing there is reachable
+
+    i = min(int(fr), angles.shape[0] - 2)
+    j = min(int(fz), angles.shape[1] - 2)
+    tr = fr - i
+    tz = fz - j
+    cell = angles[i:i + 2, j:j + 2]
+
+    if np.isnan(cell).any():
+        # Edge of the reachable area, only trust the closest node
+        nearest = angles[int(round(fr)), int(round(fz))]
+        if np.isnan(nearest).any():
+            return None
+        shoulder, elbow, wrist = nearest
+    else:
+        # Bilinear interpolation between the four nodes around the target
+        shoulder, elbow, wrist = ((1 - tr) * (1 - tz) * cell[0, 0] + (1 - tr) * tz * cell[0, 1]
+                                  + tr * (1 - tz) * cell[1, 0] + tr * tz * cell[1, 1])
+
+    return theta_base_deg, float(shoulder), float(elbow), float(wrist)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    save_table(build_table())
+    print(f"Built {TABLE_PATH} in {time.perf_counter() - start:.1f} s")
+
+    start = time.perf_counter()
+    load_table()
+    print(f"Loaded table in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # Compare with calculate() on random targets in front of the arm
+    rng = np.random.default_rng(0)
+    worst = 0.0
+    mismatched = 0
+    lookup_time = 0.0
+    for x, z in zip(rng.uniform(-15, 15, 2000), rng.uniform(0.5, 20, 2000)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = calculate_angles_for.calculate(x, 0, z)
+        start = time.perf_counter()
+        result = lookup(x, 0, z)
+        lookup_time += time.perf_counter() - start
+        if (expected is None) != (result is None):
+            mismatched += 1
+        elif expected:
+            worst = max(worst, max(abs(a - b) for a, b in zip(expected, result)))
+
+    print(f"Max angle difference: {worst:.2f}° (tolerance {TOLERANCE}°)")
+    print(f"Reachability mismatches (edge of the workspace): {mismatched} / 2000")
+    print(f"Average lookup: {lookup_time / 2000 * 1e6:.1f} us")
+    assert worst <= TOLERANCE, f"lookup() is {worst:.2f}° off calculate(), more than {TOLERANCE}°"
+    # Only targets within a grid cell of the workspace edge may disagree, that is well under 1% of them
+    assert mismatched <= 20, f"{mismatched} / 2000 targets reachable in one and not the other"
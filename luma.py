@@ -0,0 +1,73 @@
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+# Grayscale frames for marker detection without the RGB -> BGR -> GRAY round trip.
+#
+# With the camera configured for YUV420 the first `height` rows of every frame already are the
+# luminance plane, so the gray frame is just a view into it. RGB frames (e.g. from a fake
+# camera source) are converted straight to gray into a buffer that is reused between frames.
+# A gray frame and a YUV420 frame are both one 2-D array, so the converter has to be told which
+# one it gets (format="YUV420"), it does not guess it from the frame size.
+
+
+class GrayConverter:
+    def __init__(self, format=None):
+        self.format = format  # "YUV420" for frames from the camera configured that way, None otherwise
+        self.buffer = None
+
+    def __call__(self, frame):
+        if frame.ndim == 2:
+            if self.format == "YUV420":
+                return frame[:frame.shape[0] * 2 // 3]  # The Y plane needs no conversion at all
+            return frame  # Already gray
+
+        if self.buffer is None or self.buffer.shape != frame.shape[:2]:
+            self.buffer = np.empty(frame.shape[:2], dtype=np.uint8)
+        code = cv2.COLOR_RGBA2GRAY if frame.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        return cv2.cvtColor(frame, code, dst=self.buffer)
+
+
+def _measure(convert, frame, runs=50):
+    convert(frame)  # Warm up, lets the converter allocate its buffer
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(runs):
+        convert(frame)
+    elapsed = (time.perf_counter() - start) / runs
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    # Per-frame time and allocations at 1080p, plain NumPy arrays so no camera is needed
+    rng = np.random.default_rng(0)
+    rgb = rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    yuv = rng.integers(0, 256, (1620, 1920), dtype=np.uint8)
+    frame_bytes = 1080 * 1920
+
+    def old_path(frame):
+        bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        return bgr, cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+
+    def new_path(converter):
+        return lambda frame: (converter(frame),)
+
+    for name, convert, frame in (("RGB -> BGR -> GRAY", old_path, rgb),
+                                 ("RGB -> GRAY reused buffer", new_path(GrayConverter()), rgb),
+                                 ("YUV420 Y plane", new_path(GrayConverter("YUV420")), yuv)):
+        elapsed, peak = _measure(convert, frame)
+        # Arrays that are neither the input frame nor a buffer kept from the previous frame
+        first = convert(frame)
+        second = convert(frame)
+        allocations = sum(not (np.shares_memory(a, frame) or np.shares_memory(a, b)) for a, b in zip(first, second))
+        print(f"{name:26s} {elapsed * 1000:6.2f} ms/frame, {allocations} full-frame allocations, "
+              f"peak new memory {peak / frame_bytes:.1f}x a gray frame")
+
+    # Gray frames of any height come back whole, only YUV420 frames lose their U and V rows
+    for height in (480, 720, 1080):
+        gray = np.zeros((height, height * 16 // 9), dtype=np.uint8)
+        assert GrayConverter()(gray).shape == gray.shape, f"{height} rows gray frame was cropped"
+    assert GrayConverter("YUV420")(yuv).shape == (1080, 1920)
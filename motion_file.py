@@ -0,0 +1,174 @@
+import os
+import struct
+import sys
+import time
+import numpy as np
+from control_loop import ControlLoop, RATE_HZ
+
+# Recorded arm motion, e.g. from a KeyboardControlledArm session ('r' starts and stops recording),
+# so a good motion can be played back instead of copying the angles into move_motor by hand.
+#
+# Layout (little endian):
+#   header   magic, joints, start time (unix seconds), padded to HEADER_SIZE
+#   records  float32 (n, 1 + joints): seconds since the start, then the angle of every joint
+# Records are appended as they come and the count follows from the file size, so a file is usable
+# even if the recording was cut off. load() memory maps the records.
+
+MAGIC = b"ARMMOT01"
+HEADER = struct.Struct("<8sId")
+HEADER_SIZE = 32
+JOINTS = 5
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "motion_recordings")
+
+
+class MotionRecorder:
+    def __init__(self, path, joints=JOINTS):
+        self.path = path
+        self.joints = joints
+        self.count = 0
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, joints, time.time()).ljust(HEADER_SIZE, b"\0"))
+
+    # Function to append one sample, t in seconds since the recording started
+    def add(self, t, angles):
+        self.file.write(np.array([t, *angles], dtype=np.float32).tobytes())
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+# Function to open a recording, returns its records as a read-only (n, 1 + joints) float32 array
+def load(path):
+    with open(path, "rb") as f:
+        magic, joints, _ = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a motion file")
+    count = (os.path.getsize(path) - HEADER_SIZE) // (4 * (1 + joints))
+    if count == 0:
+        return np.zeros((0, 1 + joints), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_SIZE, shape=(count, 1 + joints))
+
+
+# Function to keep every step-th record (and the last one)
+def downsample(records, step):
+    keep = np.arange(0, len(records), step)
+    if len(records) and keep[-1] != len(records) - 1:
+        keep = np.append(keep, len(records) - 1)
+    return np.asarray(records[keep])
+
+
+# Function to drop the records that lie on a straight line between their neighbours, within tolerance
+# degrees on every joint (Ramer-Douglas-Peucker). Playback interpolates linearly between the rest.
+def simplify(records, tolerance=0.5):
+    records = np.asarray(records)
+    if len(records) < 3:
+        return records
+    keep = np.zeros(len(records), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(records) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        t = records[first + 1:last, 0]
+        share = (t - records[first, 0]) / max(records[last, 0] - records[first, 0], 1e-9)
+        line = records[first, 1:] + share[:, None] * (records[last, 1:] - records[first, 1:])
+        error = np.abs(records[first + 1:last, 1:] - line).max(axis=1)
+        worst = int(np.argmax(error))
+        if error[worst] > tolerance:
+            middle = first + 1 + worst
+            keep[middle] = True
+            stack += [(first, middle), (middle, last)]
+    return records[keep]
+
+
+# Function to play records back on a ServoKit-shaped kit at a fixed control rate, speed > 1 plays faster.
+# Every tick the angles are interpolated between the records. angles ({channel: angle}) is kept up to date.
+def play(records, kit, speed=1.0, rate_hz=RATE_HZ, clock=None, angles=None, loop=None):
+    records = np.asarray(records)
+    loop = loop or ControlLoop(kit, rate_hz, clock, log_interval=None)
+    times = (records[:, 0] - records[0, 0]) / speed
+    ticks = int(np.ceil(times[-1] * rate_hz)) + 1
+    angles = angles if angles is not None else {}
+
+    def step(tick):
+        t = min(tick / rate_hz, times[-1])
+        for channel in range(records.shape[1] - 1):
+            angles[channel] = float(np.interp(t, times, records[:, 1 + channel]))
+        loop.write(angles)
+
+    loop.run(step, ticks)
+    return angles
+
+
+# Function to play a recording on the arm through move_motor: moves to the first pose smoothly, then
+# streams the rest. step and tolerance thin out the records first (see downsample() and simplify()).
+def play_file(path, speed=1.0, step=1, tolerance=None):
+    import move_motor
+
+    records = load(path)
+    if step > 1:
+        records = downsample(records, step)
+    if tolerance is not None:
+        records = simplify(records, tolerance)
+    print(f"Playing {path}: {len(records)} records, {records[-1, 0] - records[0, 0]:.1f} s at {speed}x")
+
+    move_motor.move_motors({channel: float(angle) for channel, angle in enumerate(records[0, 1:])})
+    move_motor.wait_settled()
+    engine = move_motor.get_engine()
+    start_angles = dict(move_motor.current_angles)
+    started = engine.clock.now()
+    play(records, engine.kit, speed, engine.rate_hz, angles=move_motor.current_angles, loop=engine.loop)
+    move_motor.get_motion().moved(start_angles, dict(move_motor.current_angles), started)
+    move_motor.wait_settled()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "play":
+        # python motion_file.py play FILE [speed] [step] [tolerance]
+        arguments = sys.argv[2:] + [None] * 3
+        play_file(arguments[0], float(arguments[1] or 1.0), int(arguments[2] or 1),
+                  float(arguments[3]) if arguments[3] else None)
+        sys.exit()
+
+    # Round trip: record a synthetic 10 s teleop session at 50 Hz, load it back, play it on a fake
+    # ServoKit at 1x and 3x, and compare what the servos got with what was recorded (plain downsampling
+    # smears the jump of the gripper closing over several ticks, the simplification keeps it)
+    import tempfile
+    from clock import VirtualClock
+    from fake_servokit import FakeServoKit
+
+    path = os.path.join(tempfile.mkdtemp(), "session.motion")
+    recorder = MotionRecorder(path)
+    for tick in range(500):
+        t = tick / 50
+        recorder.add(t, [90 + 40 * np.sin(t / 2), 95 - min(t, 5) * 4, 80 + 2 * t, 45, 90 if t < 6 else 148])
+    recorder.close()
+
+    records = load(path)
+    print(f"{recorder.count} records, {os.path.getsize(path)} bytes, loaded back {len(records)} "
+          f"({'memory mapped' if isinstance(records, np.memmap) else 'in memory'})")
+    assert len(records) == recorder.count and os.path.getsize(path) == HEADER_SIZE + records.nbytes
+    assert records[-1, 0] == np.float32(499 / 50) and records[-1, 5] == 148, "records did not load back"
+
+    # Largest error allowed for each, downsampling has no bound (the gripper jump shows that)
+    for name, thinned, bound in (("all records", records, 0.0), ("every 5th", downsample(records, 5), None),
+                                 ("simplified 0.5 deg", simplify(records, 0.5), 0.5)):
+        for speed in (1.0, 3.0):
+            clock = VirtualClock()
+            kit = FakeServoKit(clock=clock)
+            play(thinned, kit, speed, clock=clock)
+            written = {channel: [] for channel in range(JOINTS)}
+            for t, channel, angle in kit.writes:
+                written[channel].append((t, angle))
+            error = max(abs(angle - np.interp(t * speed, records[:, 0], records[:, 1 + channel]))
+                        for channel in written for t, angle in written[channel])
+            print(f"{name:18s} {len(thinned):4d} waypoints, {speed:.0f}x: played in {clock.now():5.2f} s, "
+                  f"max {error:.2f} degrees from the recording")
+            # Every tick until the last record, plus the tick the loop waits after it
+            length = (records[-1, 0] - records[0, 0]) / speed
+            assert abs(clock.now() - length) <= 2 / RATE_HZ, f"{name} at {speed}x played in {clock.now():.2f} s"
+            if bound is not None:
+                assert error <= bound + 1e-3, f"{name} at {speed}x is {error:.2f} degrees off"
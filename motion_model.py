@@ -0,0 +1,132 @@
+import json
+import os
+from clock import SystemClock
+
+# When has the arm really finished a move?
+#
+# move_motor used to wait a fixed time after every move (up to 3 s), whether the arm still moved or
+# had stopped long ago. The motion model estimates it per joint from the distance it was commanded and
+# its profile in motion_profile.json:
+#   speed   degrees per second the servo really turns (under load), it can lag behind the trajectory
+#   settle  seconds it keeps swinging after arriving (for the gripper: until it has a firm grip)
+# move_motor waits for every joint to settle before the next move starts, and only for as long as needed.
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where the profile lives, can be changed with the ROBOTIC_ARM_MOTION_PROFILE environment variable
+DEFAULT_PATH = os.environ.get("ROBOTIC_ARM_MOTION_PROFILE", os.path.join(MODULE_DIR, "motion_profile.json"))
+
+
+# Function to read the profile, returns {channel: {"speed": deg/s, "settle": s}}
+def load_profile(path=DEFAULT_PATH):
+    with open(path) as f:
+        return {int(channel): joint for channel, joint in json.load(f).items()}
+
+
+class MotionModel:
+    def __init__(self, profile, clock=None):
+        self.profile = profile
+        self.clock = clock or SystemClock()
+        self.settled_at = {channel: 0.0 for channel in profile}  # Clock time each joint is still again
+        self.waited = 0.0  # Seconds spent waiting for joints to settle
+
+    # Function to record a finished move. start_angles are the angles before the move, targets
+    # ({channel: angle}) the angles the trajectory ended on, started the clock time it started.
+    def moved(self, start_angles, targets, started):
+        commands_done = self.clock.now()
+        for channel, target in targets.items():
+            joint = self.profile[channel]
+            arrival = max(commands_done, started + abs(target - start_angles[channel]) / joint["speed"])
+            self.settled_at[channel] = arrival + joint["settle"]
+
+    # Function returning the clock time at which the given joints (all by default) are all still
+    def settle_time(self, channels=None):
+        channels = self.settled_at if channels is None else channels
+        return max(self.settled_at[channel] for channel in channels)
+
+    # Function to wait until the given joints (all by default) have settled, returns the time waited
+    def wait(self, channels=None):
+        remaining = self.settle_time(channels) - self.clock.now()
+        if remaining <= 0:
+            return 0.0
+        self.clock.sleep(remaining)
+        self.waited += remaining
+        return remaining
+
+
+if __name__ == "__main__":
+    # One pick and place cycle on simulated servos on a virtual clock: the fixed waits against the
+    # motion model. Every time a move starts, every simulated joint has to be at its last command.
+    # The simulated joints stop dead on arrival, so this checks the arrival estimate (distance / speed)
+    # and not the settle times. Three cases:
+    #   servos as fast as the profile says (faster than the trajectory, they never lag)
+    #   shoulder and elbow slower than the trajectory, the model still using the profile: the next
+    #     move starts while they are still moving, which the check has to catch
+    #   the same slow servos with their real speeds in the profile
+    import hardware
+    import move_motor
+    import arm
+    from clock import VirtualClock
+    from trajectory import TrajectoryEngine
+
+    profile = load_profile()
+    angles = (97.9, 19.9, 65.0, 19.7)
+    home = dict(move_motor.current_angles)
+    speeds = {channel: joint["speed"] for channel, joint in profile.items()}
+    slow_speeds = {**speeds, 1: 30, 2: 40}  # Degrees per second, under the trajectory's 50
+    slow_profile = {channel: dict(joint, speed=slow_speeds[channel]) for channel, joint in profile.items()}
+
+    def simulator(servo_speeds):
+        clock = VirtualClock()
+        servos = hardware.SimServoKit(clock=clock, max_speed=servo_speeds)
+        hardware.use_simulator(clock=clock, servos=servos)
+        return clock, servos
+
+    # The cycle as it was, with the fixed sleeps
+    clock, servos = simulator(speeds)
+    engine = TrajectoryEngine(servos, dict(home), clock=clock)
+    engine.loop.log_interval = None
+    for targets, wait in (({4: 90}, .5), ({1: 90, 2: 90, 3: 45, 0: 90}, 3),  # reset
+                          ({0: angles[0], 2: angles[2], 3: angles[3]}, 0), ({1: angles[1]}, 0), ({4: 148}, 1),  # grab
+                          ({4: 150}, .5), ({1: 90, 0: 90, 2: 90, 3: 45}, 3),  # pick up
+                          ({0: 174, 1: 108, 2: 155, 3: 11}, .1), ({4: 100}, 3),  # place
+                          ({4: 90}, .5), ({1: 90, 2: 90, 3: 45, 0: 90}, 3)):  # reset
+        engine.move(targets)
+        clock.sleep(wait)
+    fixed = clock.now()
+    print(f"Fixed waits: {fixed:.2f} s per cycle")
+
+    # The same cycle through move_motor with the motion model, returns the cycle time, the moves and
+    # the ones that started while a joint was still on its way
+    def model_cycle(name, servo_speeds, model_profile):
+        clock, servos = simulator(servo_speeds)
+        move_motor.current_angles.update(home)
+        move_motor.engine = None
+        move_motor.motion = MotionModel(model_profile, clock=clock)
+        engine = move_motor.get_engine()
+        engine.loop.log_interval = None
+        moves = 0
+        early = 0
+        move = engine.move
+
+        def checked_move(targets, duration=None):
+            nonlocal moves, early
+            moves += 1
+            early += servos.time_to_settle() > 1e-9
+            return move(targets, duration)
+
+        engine.move = checked_move
+        arm.pick_and_place(*angles)
+        move_motor.wait_settled()
+        early += servos.time_to_settle() > 1e-9  # The arm is still at the end of the cycle too
+        print(f"{name}: {clock.now():.2f} s per cycle, {move_motor.motion.waited:.2f} s of it waiting for joints "
+              f"to settle, {early} of {moves} moves started before the joints had arrived")
+        return clock.now(), early
+
+    settled, early = model_cycle("Motion model", speeds, profile)
+    assert early == 0, "a move started while a joint was still moving"
+    assert settled < fixed, "the motion model is not faster than the fixed waits"
+    _, early = model_cycle("Slow servos, profile not updated", slow_speeds, profile)
+    assert early > 0, "the check did not notice the joints lagging behind the model"
+    _, early = model_cycle("Slow servos in the profile", slow_speeds, slow_profile)
+    assert early == 0, "a move started while a slow joint was still moving"
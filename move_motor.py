@@ -1,8 +1,7 @@
-from time import sleep
-from adafruit_servokit import ServoKit
-
-# Initialize the ServoKit instance for 16 channels (controls up to 16 servos)
-kit = ServoKit(channels=16)
+import hardware
+import tracing
+from motion_model import MotionModel, load_profile
+from trajectory import TrajectoryEngine
 
 # Dictionary to store the current angles of each motor
 current_angles = {
@@ -13,63 +12,66 @@ current_angles = {
     4: 90   # Gripper motor starting fully open at 90 degrees
 }
 
-# Function to drive a motor to the specified angle smoothly
-def move_motor(motor_id, target_angle):
-    if motor_id not in current_angles:
-        print(f"Error: Invalid motor ID {motor_id}. Motor ID must be between 0 and 4.")
-        return
+# Moves the motors together along a smooth path, keeps current_angles up to date. Created on first
+# use with the servos and the clock from hardware.py.
+engine = None
+
+def get_engine():
+    global engine
+    if engine is None:
+        engine = TrajectoryEngine(hardware.get_servos(), current_angles, clock=hardware.get_clock())
+    return engine
+
+# Knows when each joint has really stopped after a move (see motion_model.py), instead of fixed sleeps
+motion = None
 
-    if target_angle < 0 or target_angle > 180:
-        print(f"Error: Target angle {target_angle} out of range. Must be between 0 and 180 degrees.")
-        return
+def get_motion():
+    global motion
+    if motion is None:
+        motion = MotionModel(load_profile(), clock=hardware.get_clock())
+    return motion
 
-    current_angle = current_angles[motor_id]
-    step = 1 if target_angle > current_angle else -1
+# Function to wait until every joint has arrived and stopped swinging
+def wait_settled():
+    with tracing.span("settle"):
+        get_motion().wait()
 
-    # Slowly move to the target angle
-    for angle in range(int(current_angle), int(target_angle), step):
-        kit.servo[motor_id].angle = angle
-        current_angles[motor_id] = angle
-        sleep(0.02)  # Adjust the sleep time to control the speed of movement
+# Function to drive several motors ({motor id: angle}) at once, they all arrive at the same time
+def move_motors(targets):
+    for motor_id, target_angle in targets.items():
+        if motor_id not in current_angles:
+            print(f"Error: Invalid motor ID {motor_id}. Motor ID must be between 0 and 4.")
+            return
 
-    # Set the final target angle
-    kit.servo[motor_id].angle = int(target_angle)
-    current_angles[motor_id] = target_angle
-    print(f"Motor {motor_id} moved to {target_angle} degrees.")
+        if target_angle < 0 or target_angle > 180:
+            print(f"Error: Target angle {target_angle} out of range. Must be between 0 and 180 degrees.")
+            return
+
+    # The next move only starts once the last one has settled
+    wait_settled()
+    with tracing.span("move", targets):
+        start_angles = dict(current_angles)
+        started = get_engine().clock.now()
+        get_engine().move(targets)
+        get_motion().moved(start_angles, targets, started)
+    print(f"Motors moved to {targets}.")
+
+# Function to drive a motor to the specified angle smoothly
+def move_motor(motor_id, target_angle):
+    move_motors({motor_id: target_angle})
 
 def reset_motors():
 	move_motor(4,90)
-	sleep(.5)
-	move_motor(1,90)
-	sleep(0.1)
-	move_motor(2,90)
-	sleep(0.1)
-	move_motor(3,45)
-	sleep(0.1)
-	move_motor(0,90)
-	sleep(3)
+	move_motors({1: 90, 2: 90, 3: 45, 0: 90})
+	wait_settled()
 	
 	
 def pick_up():
 	move_motor(4,150)
-	sleep(.5)
-	move_motor(1,90)
-	sleep(0.1)
-	move_motor(0, 90)
-	sleep(0.1)
-	move_motor(2,90)
-	sleep(0.1)
-	move_motor(3,45)
-	sleep(3)
+	move_motors({1: 90, 0: 90, 2: 90, 3: 45})
+	wait_settled()
 
 def place_it():
-	move_motor(0,174)
-	sleep(.5)
-	move_motor(1,108)
-	sleep(0.3)
-	move_motor(2, 155)
-	sleep(0.3)
-	move_motor(3,11)
-	sleep(0.1)
+	move_motors({0: 174, 1: 108, 2: 155, 3: 11})
 	move_motor(4, 100)
-	sleep(3)
+	wait_settled()
@@ -0,0 +1,82 @@
+import sys
+from collections import deque
+import numpy as np
+
+# Filtering of successive marker positions so one noisy frame does not send the arm to the wrong place.
+#
+# The estimate is the running median of the last few positions, which ignores single bad frames.
+# It counts as converged once the samples agree with it (median absolute deviation) and it stopped
+# moving, both within a tolerance in inches.
+
+
+class MedianPoseFilter:
+    def __init__(self, window=7, min_samples=3, tolerance=0.1):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.estimate = None
+        self.change = None  # How far the estimate moved on the last update
+
+    def reset(self):
+        self.samples.clear()
+        self.estimate = None
+        self.change = None
+
+    # Function to add a new (x, y, z) position, returns the current estimate
+    def update(self, position):
+        self.samples.append(np.asarray(position, dtype=float))
+        estimate = np.median(self.samples, axis=0)
+        if self.estimate is not None:
+            self.change = np.abs(estimate - self.estimate).max()
+        self.estimate = estimate
+        return estimate
+
+    def spread(self):
+        return np.median(np.abs(np.array(self.samples) - self.estimate), axis=0).max()
+
+    def converged(self):
+        if len(self.samples) < self.min_samples or self.change is None:
+            return False
+        return self.change <= self.tolerance and self.spread() <= self.tolerance
+
+
+# Function to run a recorded (N, 3) sequence of positions through a filter.
+# Returns (frames until converged or None, final estimate).
+def replay(positions, pose_filter=None):
+    pose_filter = pose_filter or MedianPoseFilter()
+    for frame, position in enumerate(positions, start=1):
+        estimate = pose_filter.update(position)
+        if pose_filter.converged():
+            return frame, estimate
+    return None, pose_filter.estimate
+
+
+# Noisy positions around a fixed target with a few bad frames, for when no recordings are given
+def synthetic_sequence(target, frames=40, noise=0.05, outliers=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = np.asarray(target) + rng.normal(0, noise, (frames, 3))
+    bad = rng.random(frames) < outliers
+    positions[bad] += rng.normal(0, 1.5, (bad.sum(), 3))
+    return positions
+
+
+if __name__ == "__main__":
+    # Replay recorded sequences (text files with one "x y z" line per frame, see np.savetxt), or
+    # synthetic ones, and compare the filter with taking the first frame as it is
+    if len(sys.argv) > 1:
+        sequences = [np.loadtxt(path).reshape(-1, 3) for path in sys.argv[1:]]
+    else:
+        sequences = [synthetic_sequence((2.0, 0.5, 9.0), seed=seed) for seed in range(20)]
+
+    frames_needed = []
+    filtered_estimates = []
+    first_frames = []
+    for positions in sequences:
+        frames, estimate = replay(positions)
+        frames_needed.append(frames if frames is not None else len(positions))
+        filtered_estimates.append(estimate)
+        first_frames.append(positions[0])
+
+    print(f"Frames to convergence: mean {np.mean(frames_needed):.1f}, max {max(frames_needed)}")
+    print(f"Variance of the first frame:     {np.var(first_frames, axis=0).round(4)}")
+    print(f"Variance of the filtered result: {np.var(filtered_estimates, axis=0).round(4)}")
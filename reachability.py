@@ -0,0 +1,138 @@
+import math
+import os
+import sys
+import time
+import numpy as np
+import calculate_angles_for
+import ik_table
+
+# Map of where the camera can see a block that the arm can reach, to turn a target down before any
+# IK or motion work.
+#
+# The grid covers the camera coordinates camera.py reports (inches), every voxel holds one bit:
+# whether calculate_angles_for finds valid angles for its center after the corrections arm.py applies
+# to the camera coordinates, and the IK table covers it. The IK does not use y, so along y the grid
+# only bounds the workspace to the height range the blocks can be in. Stored bit-packed in
+# reachability.npz, one lookup is an index computation and a bit test.
+
+GRID_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reachability.npz")
+
+# Grid extent in camera coordinates (inches) and voxel size
+X_RANGE = (-15.0, 15.0)
+Y_RANGE = (-6.0, 6.0)
+Z_RANGE = (0.0, 25.0)
+STEP = 0.25
+
+# Camera points the corrections are checked on, a grid built with other corrections is built again
+_PROBES = np.array([[0.0, 0.0, 10.0], [5.0, 1.0, 15.0], [-8.0, -2.0, 4.0]])
+
+
+def _axis(extent):
+    return extent[0] + STEP * np.arange(int(round((extent[1] - extent[0]) / STEP)) + 1)
+
+
+# Function to work out the reachable voxels. correct(x, y, z) turns camera coordinates into the
+# target of the IK (arm.correct_target), it has to work on NumPy arrays as well.
+def build_grid(correct):
+    xs, ys, zs = _axis(X_RANGE), _axis(Y_RANGE), _axis(Z_RANGE)
+    shape = (len(xs), len(ys), len(zs))
+
+    # y does not change the IK, so only the x/z plane is solved and repeated along y
+    x, z = np.meshgrid(xs, zs, indexing="ij")
+    tx, _, tz = correct(x.ravel(), np.zeros(x.size), z.ravel())
+    _, reachable = calculate_angles_for.calculate_batch(np.column_stack([tx, np.zeros(x.size), tz]))
+    # arm.py takes its angles from the IK table, nothing is reachable past the radius it covers
+    reachable &= np.hypot(tx, tz) <= ik_table.R_MAX
+    plane = reachable.reshape(len(xs), 1, len(zs))
+    voxels = np.broadcast_to(plane, shape)
+
+    return {"bits": np.packbits(voxels.ravel()), "shape": np.array(shape),
+            "origin": np.array([X_RANGE[0], Y_RANGE[0], Z_RANGE[0]]), "step": STEP,
+            "probes": np.column_stack(correct(*_PROBES.T))}
+
+
+def save_grid(grid, path=GRID_PATH):
+    np.savez_compressed(path, **grid)
+
+
+class Workspace:
+    def __init__(self, grid):
+        self.bits = grid["bits"]
+        self.shape = tuple(int(n) for n in grid["shape"])
+        self.origin = [float(v) for v in grid["origin"]]
+        self.step = float(grid["step"])
+
+    # Function to tell in constant time whether the block at camera coordinates (x, y, z) can be reached
+    def contains(self, x, y, z):
+        i = math.floor((x - self.origin[0]) / self.step + 0.5)
+        j = math.floor((y - self.origin[1]) / self.step + 0.5)
+        k = math.floor((z - self.origin[2]) / self.step + 0.5)
+        if not (0 <= i < self.shape[0] and 0 <= j < self.shape[1] and 0 <= k < self.shape[2]):
+            return False
+        index = (i * self.shape[1] + j) * self.shape[2] + k
+        return bool(self.bits[index >> 3] >> (7 - (index & 7)) & 1)
+
+    def count(self):
+        return int(np.unpackbits(self.bits).sum())
+
+    # Function to return the centers of the reachable voxels as an (N, 3) array of camera coordinates
+    def points(self):
+        voxels = np.unpackbits(self.bits, count=int(np.prod(self.shape))).reshape(self.shape)
+        return np.array(self.origin) + self.step * np.argwhere(voxels)
+
+    # Function to write the reachable voxels as a PLY point cloud (MeshLab, CloudCompare, Blender)
+    def export_ply(self, path):
+        points = self.points()
+        with open(path, "w") as f:
+            f.write(f"ply\nformat ascii 1.0\nelement vertex {len(points)}\n"
+                    "property float x\nproperty float y\nproperty float z\nend_header\n")
+            np.savetxt(f, points, fmt="%.3f")
+        return len(points)
+
+
+# Function to load the workspace, built and saved first if the file is missing or was built with
+# other corrections
+def load_or_build(correct, path=GRID_PATH):
+    if os.path.exists(path):
+        with np.load(path) as data:
+            grid = {name: data[name] for name in data.files}
+        if np.allclose(grid["probes"], np.column_stack(correct(*_PROBES.T))):
+            return Workspace(grid)
+        print(f"Reachability map at {path} was built with other corrections, building it again...")
+    else:
+        print(f"Reachability map not found at {path}, building it (one time only)...")
+    grid = build_grid(correct)
+    save_grid(grid, path)
+    return Workspace(grid)
+
+
+if __name__ == "__main__":
+    # Build the map, check it against the IK on random camera points, and export it (optionally to
+    # the PLY file given as argument)
+    from arm import correct_target
+
+    start = time.perf_counter()
+    grid = build_grid(correct_target)
+    save_grid(grid, GRID_PATH)
+    workspace = Workspace(grid)
+    print(f"Built in {time.perf_counter() - start:.2f} s: {workspace.count()} of {int(np.prod(workspace.shape))} "
+          f"voxels reachable, {os.path.getsize(GRID_PATH) / 1024:.1f} KB on disk, {workspace.bits.nbytes / 1024:.1f} KB in memory")
+
+    rng = np.random.default_rng(0)
+    points = np.column_stack([rng.uniform(*X_RANGE, 5000), rng.uniform(*Y_RANGE, 5000), rng.uniform(*Z_RANGE, 5000)])
+    tx, ty, tz = correct_target(*points.T)
+    _, expected = calculate_angles_for.calculate_batch(np.column_stack([tx, ty, tz]))
+
+    start = time.perf_counter()
+    result = [workspace.contains(*point) for point in points]
+    check_time = (time.perf_counter() - start) / len(points)
+    start = time.perf_counter()
+    looked_up = [ik_table.lookup(*target) is not None for target in zip(tx, ty, tz)]
+    lookup_time = (time.perf_counter() - start) / len(points)
+
+    print(f"Check: {check_time * 1e6:.2f} us per point (IK table lookup {lookup_time * 1e6:.2f} us), "
+          f"{int(np.sum(np.array(result) != np.array(looked_up)))} / {len(points)} disagree with the IK table "
+          f"(voxel edges), {int(np.sum(np.array(result) != expected))} with calculate() (which also reaches past the table)")
+
+    if len(sys.argv) > 1:
+        print(f"Wrote {workspace.export_ply(sys.argv[1])} reachable voxels to {sys.argv[1]}")
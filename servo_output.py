@@ -0,0 +1,201 @@
+import time
+
+# Servo output straight to the PCA9685 with as little I2C traffic as possible.
+#
+# Setting kit.servo[n].angle on a ServoKit is one I2C transaction per channel, every time, even when
+# the angle did not change. Here setting an angle only remembers it. flush() then sends the channels
+# whose pulse actually changed, all in one auto-increment block write to the LED registers.
+# Works like a ServoKit for the rest of the code (kit.servo[n].angle = ...), plus flush().
+
+ADDRESS = 0x40
+FREQUENCY = 50  # Hz, standard for hobby servos
+MIN_PULSE = 750  # Microseconds at 0 degrees, same defaults as ServoKit
+MAX_PULSE = 2250  # Microseconds at ACTUATION_RANGE degrees
+ACTUATION_RANGE = 180
+OSCILLATOR = 25000000  # PCA9685 internal clock
+
+# PCA9685 registers
+MODE1 = 0x00
+PRESCALE = 0xFE
+LED0_ON_L = 0x06
+MODE1_RESTART = 0x80
+MODE1_AI = 0x20  # Auto-increment, lets one write fill the registers of several channels
+MODE1_SLEEP = 0x10
+
+# Resolution of the angle to pulse lookup table
+STEPS_PER_DEGREE = 10
+
+
+class _Servo:
+    def __init__(self, output, channel):
+        self.output = output
+        self.channel = channel
+
+    @property
+    def angle(self):
+        return self.output.angles[self.channel]
+
+    @angle.setter
+    def angle(self, value):
+        self.output.set_angle(self.channel, value)
+
+
+class ServoOutput:
+    def __init__(self, i2c, address=ADDRESS, channels=16, frequency=FREQUENCY,
+                 min_pulse=MIN_PULSE, max_pulse=MAX_PULSE, actuation_range=ACTUATION_RANGE):
+        self.i2c = i2c  # busio.I2C or anything with try_lock(), writeto() and unlock()
+        self.address = address
+        self.frequency = frequency
+        self.actuation_range = actuation_range
+        self.servo = [_Servo(self, channel) for channel in range(channels)]
+        self.angles = [None] * channels
+        self.counts = [None] * channels  # 12-bit OFF count waiting to be sent
+        self.sent = [None] * channels  # 12-bit OFF count the chip has now
+        self.dirty = set()
+
+        # Angle to pulse conversion done once for every step of the range
+        period = 1000000 / frequency
+        self.count_table = [
+            round((min_pulse + (max_pulse - min_pulse) * step / (actuation_range * STEPS_PER_DEGREE)) / period * 4096)
+            for step in range(actuation_range * STEPS_PER_DEGREE + 1)
+        ]
+
+    # Function to set up the chip: PWM frequency and auto-increment
+    def begin(self):
+        prescale = round(OSCILLATOR / (4096 * self.frequency)) - 1
+        self._write(bytes([MODE1, MODE1_SLEEP]))  # The prescaler can only be changed while asleep
+        self._write(bytes([PRESCALE, prescale]))
+        self._write(bytes([MODE1, MODE1_AI]))
+        time.sleep(0.005)  # Oscillator start up
+        self._write(bytes([MODE1, MODE1_RESTART | MODE1_AI]))
+        return self
+
+    def set_angle(self, channel, angle):
+        if angle is None:
+            count = 0  # No pulse, the servo goes limp
+        else:
+            if not 0 <= angle <= self.actuation_range:
+                raise ValueError("Angle out of range")
+            count = self.count_table[int(round(angle * STEPS_PER_DEGREE))]
+        self.angles[channel] = angle
+        self.counts[channel] = count
+        if count != self.sent[channel]:
+            self.dirty.add(channel)
+        else:
+            self.dirty.discard(channel)
+
+    # Function to send every changed channel, returns the number of I2C transactions it took
+    def flush(self):
+        if not self.dirty:
+            return 0
+        transactions = 0
+
+        # One block from the first to the last changed channel. Channels in between that did not change
+        # get their current value again, which is cheaper than another transaction. Only channels that
+        # were never set split the block, so they do not get a pulse by accident.
+        first = min(self.dirty)
+        last = max(self.dirty)
+        channel = first
+        while channel <= last:
+            if self.counts[channel] is None:
+                channel += 1
+                continue
+            start = channel
+            data = bytearray([LED0_ON_L + 4 * start])
+            while channel <= last and self.counts[channel] is not None:
+                count = self.counts[channel]
+                data += bytes([0, 0, count & 0xFF, count >> 8])  # ON at 0, OFF at count
+                self.sent[channel] = count
+                channel += 1
+            self._write(data)
+            transactions += 1
+
+        self.dirty.clear()
+        return transactions
+
+    def _write(self, data):
+        while not self.i2c.try_lock():
+            pass
+        try:
+            self.i2c.writeto(self.address, data)
+        finally:
+            self.i2c.unlock()
+
+
+# Function to open the real PCA9685 on the Raspberry Pi I2C pins
+def open_servo_output(channels=16):
+    import board
+    import busio
+    return ServoOutput(busio.I2C(board.SCL, board.SDA), channels=channels).begin()
+
+
+# I2C bus that only counts the traffic, and keeps the PCA9685 registers to check what was written.
+# With a clock, every byte takes byte_time seconds on it like on the real bus.
+class MockI2CBus:
+    def __init__(self, clock=None, byte_time=0.0):
+        self.clock = clock
+        self.byte_time = byte_time
+        self.transactions = 0
+        self.bytes = 0
+        self.registers = bytearray(256)
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def writeto(self, address, buffer):
+        self.transactions += 1
+        self.bytes += len(buffer)
+        if self.clock is not None:
+            self.clock.sleep(self.byte_time * (len(buffer) + 1))  # Address byte, then the data
+        register = buffer[0]
+        for value in buffer[1:]:
+            self.registers[register] = value
+            register += 1  # Auto-increment
+
+    def pulse_count(self, channel):
+        register = LED0_ON_L + 4 * channel
+        return self.registers[register + 2] | self.registers[register + 3] << 8
+
+
+if __name__ == "__main__":
+    # Bus traffic of ServoKit-style writes (one transaction of register + 4 bytes per channel, every
+    # time) against ServoOutput, for a 2 s trajectory on three joints and for 100 keypresses that each
+    # rewrite all five channels but only change one. The mock bus takes 90 us per byte (100 kHz I2C),
+    # that time has to show up in the loop statistics as bus write time.
+    from fake_servokit import FakeServoKit
+    from trajectory import TrajectoryEngine
+    from clock import VirtualClock
+
+    def servokit_traffic(writes):
+        return len(writes), 5 * len(writes)
+
+    def run(kit, clock):
+        engine = TrajectoryEngine(kit, {0: 90, 1: 90, 2: 90, 3: 45, 4: 90}, clock=clock)
+        engine.loop.log_interval = None
+        engine.move({0: 150, 1: 120, 2: 60}, duration=2.0)
+        angles = dict(engine.angles)
+        for press in range(100):
+            angles[1] += 0.5 if press % 2 == 0 else -0.5  # Shoulder up and down, everything else still
+            engine.loop.write(angles)
+        return angles, engine.loop.stats
+
+    fake = FakeServoKit(clock=VirtualClock())
+    run(fake, fake.clock)
+    kit_transactions, kit_bytes = servokit_traffic(fake.writes)
+
+    clock = VirtualClock()
+    bus = MockI2CBus(clock, byte_time=0.00009)
+    output = ServoOutput(bus)
+    angles, stats = run(output, clock)
+    print(f"ServoKit writes:    {kit_transactions} transactions, {kit_bytes} bytes")
+    print(f"ServoOutput writes: {bus.transactions} transactions, {bus.bytes} bytes")
+    print(stats.log_line())
+
+    assert bus.transactions < kit_transactions, "ServoOutput did not save any I2C transactions"
+    for channel, angle in angles.items():
+        assert bus.pulse_count(channel) == output.count_table[int(round(angle * STEPS_PER_DEGREE))], \
+            f"channel {channel} has the wrong pulse on the chip"
+    assert stats.summary()["bus_mean"] > 0, "the bus time of flush() is not in the loop statistics"
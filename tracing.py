@@ -0,0 +1,149 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# Spans around every stage of the pick-and-place cycle, to see where the time goes.
+#
+#     with tracing.span("detect"):
+#         ...
+#
+# Finished spans go into a ring buffer in memory (the oldest are dropped when it is full). They can
+# be written out as Chrome trace-event JSON (open it in chrome://tracing or ui.perfetto.dev) and
+# summarized per stage. While tracing is off, span() hands out one shared object whose enter and
+# exit do nothing, so the instrumented code pays a function call and nothing else.
+# Set ROBOTIC_ARM_TRACE=1 or call enable() to turn it on.
+
+ENABLED = os.environ.get("ROBOTIC_ARM_TRACE") == "1"
+CAPACITY = 100000  # Spans kept
+
+spans = deque(maxlen=CAPACITY)  # (name, start, end, thread id, args), times in seconds
+clock = time.perf_counter
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc):
+        spans.append((self.name, self.start, clock(), threading.get_ident(), self.args))
+        return False
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+# Function to time a block of code as one stage, args (a dict) are shown with the span in the trace
+def span(name, args=None):
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name, args)
+
+
+def enable(capacity=CAPACITY):
+    global ENABLED, spans
+    if capacity != spans.maxlen:
+        spans = deque(spans, maxlen=capacity)
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def clear():
+    spans.clear()
+
+
+# Function returning {stage: {"count", "total", "p50", "p95", "max"}}, in seconds
+def summary():
+    durations = {}
+    for name, start, end, _, _ in list(spans):
+        durations.setdefault(name, []).append(end - start)
+    result = {}
+    for name, values in durations.items():
+        values.sort()
+        result[name] = {
+            "count": len(values),
+            "total": sum(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1],
+        }
+    return result
+
+
+def print_summary():
+    print(f"{'stage':16s} {'count':>6s} {'total s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'max ms':>9s}")
+    for name, s in sorted(summary().items(), key=lambda item: -item[1]["total"]):
+        print(f"{name:16s} {s['count']:6d} {s['total']:9.3f} {s['p50'] * 1000:9.2f} {s['p95'] * 1000:9.2f} "
+              f"{s['max'] * 1000:9.2f}")
+
+
+# Function to write the spans as Chrome trace-event JSON, one complete ("X") event per span
+def export_chrome(path):
+    events = []
+    for name, start, end, thread, args in list(spans):
+        event = {"name": name, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6, "pid": os.getpid(), "tid": thread}
+        if args:
+            event["args"] = {key: str(value) for key, value in args.items()}
+        events.append(event)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return len(events)
+
+
+def _overhead(runs=200000):
+    start = time.perf_counter()
+    for _ in range(runs):
+        pass
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(runs):
+        with span("stage"):
+            pass
+    return (time.perf_counter() - start - loop) / runs
+
+
+if __name__ == "__main__":
+    # Cost of a span with tracing off and on, then one arm.main() cycle on the simulated hardware
+    # (in real time, so the settle waits count) with its trace written to trace.json
+    disable()
+    off = _overhead()
+    enable()
+    on = _overhead()
+    clear()
+    print(f"Span cost: {off * 1e9:.0f} ns with tracing off, {on * 1e9:.0f} ns with tracing on")
+
+    import hardware
+    import arm
+    import camera
+    import tracing  # arm and the others record into this module, not into __main__
+
+    tracing.enable()
+    hardware.use_simulator()
+    hardware.get_camera().place(0, (-0.05, 0.02, 0.25))
+    arm.main()
+    camera.stop_capture()
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "trace.json"
+    print(f"Wrote {tracing.export_chrome(path)} spans to {path}")
+    tracing.print_summary()
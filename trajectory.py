@@ -0,0 +1,129 @@
+import math
+from clock import VirtualClock
+from control_loop import ControlLoop
+
+# Moves several joints at once along a smooth profile, all of them arriving at the same time.
+#
+# The slowest joint (the one with the longest way to go) sets the duration of the move, every other
+# joint is stretched over that same time. Every tick of the control loop writes the next angle of every joint.
+
+RATE_HZ = 50  # Control ticks per second
+MAX_SPEED = 50  # Peak joint speed in degrees per second (move_motor used to do 1 degree every 20 ms)
+
+
+# Normalized profiles, position 0..1 over time 0..1
+
+# Minimum jerk, smoothest start and stop, peaks at 1.875x the average speed
+def min_jerk(s):
+    return s**3 * (10 - 15 * s + 6 * s**2)
+
+
+# Trapezoidal velocity, ramps up over the first `ramp` of the move and down over the last
+def trapezoid(s, ramp=0.2):
+    peak = 1 / (1 - ramp)
+    if s < ramp:
+        return 0.5 * peak / ramp * s**2
+    if s > 1 - ramp:
+        return 1 - 0.5 * peak / ramp * (1 - s)**2
+    return peak * (s - ramp / 2)
+
+
+# Peak speed of each profile relative to the average speed, to fit a move into MAX_SPEED
+PEAK_FACTOR = {min_jerk: 1.875, trapezoid: 1 / (1 - 0.2)}
+
+
+class TrajectoryEngine:
+    def __init__(self, kit, angles, rate_hz=RATE_HZ, max_speed=MAX_SPEED, profile=trapezoid, clock=None):
+        self.kit = kit  # ServoKit or anything shaped like it (see fake_servokit.FakeServoKit)
+        self.angles = angles  # {channel: angle}, updated as the joints move
+        self.rate_hz = rate_hz
+        self.max_speed = max_speed
+        self.profile = profile
+        self.loop = ControlLoop(kit, rate_hz, clock)  # Tick timing, see loop.stats for how well it keeps up
+        self.clock = self.loop.clock
+
+    # Time the move takes so that no joint goes faster than max_speed
+    def duration_for(self, targets):
+        distance = max(abs(target - self.angles[channel]) for channel, target in targets.items())
+        return PEAK_FACTOR[self.profile] * distance / self.max_speed
+
+    # Function to move the joints in targets ({channel: angle}) together, returns the time it took
+    def move(self, targets, duration=None):
+        if duration is None:
+            duration = self.duration_for(targets)
+        start_angles = dict(self.angles)
+        ticks = max(1, math.ceil(duration * self.rate_hz))
+        start = self.clock.now()
+
+        def step(tick):
+            s = self.profile((tick + 1) / ticks)
+            for channel, target in targets.items():
+                self.angles[channel] = start_angles[channel] + (target - start_angles[channel]) * s
+            self.loop.write(self.angles)
+
+        self.loop.run(step, ticks)
+
+        for channel, target in targets.items():
+            self.angles[channel] = target
+        return self.clock.now() - start
+
+
+if __name__ == "__main__":
+    # Compare a full cycle (reset, pick up, place, reset) done one joint at a time like move_motor used
+    # to, against moving the joints together. Simulated with a fake ServoKit on a virtual clock.
+    from fake_servokit import FakeServoKit
+
+    def cycle_sequential(angles, clock):
+        moving = 0.0
+        def move(channel, target, wait):
+            nonlocal moving
+            steps = abs(int(target) - int(angles[channel])) * 0.02  # 1 degree every 20 ms
+            moving += steps
+            clock.sleep(steps)
+            angles[channel] = target
+            clock.sleep(wait)
+        start = clock.now()
+        for channel, target, wait in ((4, 90, .5), (1, 90, .1), (2, 90, .1), (3, 45, .1), (0, 90, 3),  # reset
+                                      (0, 60, 0), (2, 120, 0), (3, 30, 0), (1, 130, 0), (4, 148, 1),  # grab
+                                      (4, 150, .5), (1, 90, .1), (0, 90, .1), (2, 90, .1), (3, 45, 3),  # pick up
+                                      (0, 174, .5), (1, 108, .3), (2, 155, .3), (3, 11, .1), (4, 100, 3),  # place
+                                      (4, 90, .5), (1, 90, .1), (2, 90, .1), (3, 45, .1), (0, 90, 3)):  # reset
+            move(channel, target, wait)
+        return clock.now() - start, moving
+
+    # Every joint of a move has to reach its target on the same tick, and none may turn faster than
+    # MAX_SPEED from one tick to the next
+    def check_move(kit, written, start_angles, targets):
+        previous = dict(start_angles)
+        arrived = {}
+        for t, channel, angle in kit.writes[written:]:
+            speed = abs(angle - previous[channel]) * RATE_HZ
+            assert speed <= MAX_SPEED * 1.001, f"channel {channel} turned at {speed:.1f} deg/s"
+            previous[channel] = angle
+            if channel in targets and channel not in arrived and abs(angle - targets[channel]) < 1e-9:
+                arrived[channel] = t
+        assert sorted(arrived) == sorted(targets), f"channels {sorted(set(targets) - set(arrived))} never arrived"
+        assert max(arrived.values()) - min(arrived.values()) < 1e-9, f"joints arrived at {arrived}"
+
+    def cycle_together(angles, clock):
+        kit = FakeServoKit(clock=clock)
+        engine = TrajectoryEngine(kit, angles, clock=clock)
+        start = clock.now()
+        moving = 0.0
+        for targets, wait in (({4: 90}, .5), ({1: 90, 2: 90, 3: 45, 0: 90}, 3),  # reset
+                              ({0: 60, 2: 120, 3: 30}, 0), ({1: 130}, 0), ({4: 148}, 1),  # grab
+                              ({4: 150}, .5), ({1: 90, 0: 90, 2: 90, 3: 45}, 3),  # pick up
+                              ({0: 174, 1: 108, 2: 155, 3: 11}, 0), ({4: 100}, 3),  # place
+                              ({4: 90}, .5), ({1: 90, 2: 90, 3: 45, 0: 90}, 3)):  # reset
+            written, start_angles = len(kit.writes), dict(engine.angles)
+            moving += engine.move(targets)
+            check_move(kit, written, start_angles, targets)
+            clock.sleep(wait)
+        return clock.now() - start, moving
+
+    home = {0: 90, 1: 90, 2: 90, 3: 45, 4: 90}
+    sequential, sequential_moving = cycle_sequential(dict(home), VirtualClock())
+    together, together_moving = cycle_together(dict(home), VirtualClock())
+    print(f"One joint at a time: {sequential:.2f} s per cycle, {sequential_moving:.2f} s of it moving")
+    print(f"Joints together:     {together:.2f} s per cycle, {together_moving:.2f} s of it moving")
+    assert together < sequential, "moving the joints together is not faster"